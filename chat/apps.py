@@ -4,3 +4,74 @@ from django.apps import AppConfig
 class ChatConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chat'
+
+    def ready(self):
+        from django.conf import settings
+
+        import crypto.crypt
+
+        crypto.crypt.configure(getattr(settings, 'CRYPTO_BACKEND', crypto.crypt.DEFAULT_BACKEND))
+
+        cache_settings = getattr(settings, 'CRYPTO_PLAINTEXT_CACHE', {})
+        crypto.crypt.configure_cache(
+            max_entries=cache_settings.get('MAX_ENTRIES'),
+            max_bytes=cache_settings.get('MAX_BYTES'),
+            zero_on_evict=cache_settings.get('ZERO_ON_EVICT'),
+        )
+
+        from crypto.executor import crypto_executor
+
+        executor_settings = getattr(settings, 'CRYPTO_EXECUTOR', {})
+        crypto_executor.configure(
+            kind=executor_settings.get('KIND'),
+            workers=executor_settings.get('WORKERS'),
+            max_pending=executor_settings.get('MAX_PENDING'),
+        )
+
+        pool_settings = getattr(settings, 'CRYPTO_DECRYPT_POOL', {})
+        crypto.crypt.configure_pool(
+            workers=pool_settings.get('WORKERS'),
+            batch_size=pool_settings.get('BATCH_SIZE'),
+            serial_threshold=pool_settings.get('SERIAL_THRESHOLD'),
+        )
+
+        from .typeahead import username_index
+
+        username_index.refresh_interval = settings.CHAT_TYPEAHEAD['REFRESH_INTERVAL']
+
+        from .persistence import message_writer
+
+        message_writer.flush_interval = settings.CHAT_WRITE_BEHIND['FLUSH_INTERVAL']
+        message_writer.batch_size = settings.CHAT_WRITE_BEHIND['BATCH_SIZE']
+
+        from . import consumers
+
+        consumers.history_max_messages = settings.CHAT_WS_HISTORY['MAX_MESSAGES']
+
+        from . import metrics
+
+        metrics.enabled = settings.CHAT_METRICS['ENABLED']
+        crypto.crypt.observer = metrics.observe_crypto if metrics.enabled else None
+        crypto_executor.observer = metrics.crypto_executor_wait.observe if metrics.enabled else None
+
+        from django.db.backends.signals import connection_created
+
+        from . import querylog
+
+        query_profiler_settings = settings.CHAT_QUERY_PROFILER
+        querylog.enabled = query_profiler_settings['ENABLED']
+        querylog.repeat_threshold = query_profiler_settings['REPEAT_THRESHOLD']
+        querylog.log_reports = query_profiler_settings['LOG']
+        querylog.reports.resize(query_profiler_settings['BUFFER_SIZE'])
+        if querylog.enabled:
+            connection_created.connect(querylog.install)
+
+        from . import profiling
+
+        profiler_settings = settings.CHAT_PROFILER
+        profiling.enabled = profiler_settings['ENABLED']
+        profiling.sample_rate = profiler_settings['SAMPLE_RATE']
+        profiling.interval = profiler_settings['INTERVAL']
+        profiling.output_dir = str(profiler_settings['OUTPUT_DIR'])
+        profiling.header = profiler_settings['HEADER']
+        profiling.token = profiler_settings['TOKEN']
@@ -0,0 +1,53 @@
+import queue
+import threading
+
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    SQLite backend that keeps a per-process pool of open connections.
+
+    Under ASGI every request runs its synchronous code on a fresh thread, so Django's
+    thread-local persistent connections (CONN_MAX_AGE) would never be reused. Instead,
+    closing a connection here returns it to a pool shared by the alias, and opening one
+    takes it back out, with the pragmas from `init_command` already applied.
+
+    The pool size is the alias's `POOL_SIZE` entry (0 disables pooling). Connections closed
+    inside a transaction, or beyond the pool size, are really closed.
+    """
+
+    _pools = {}
+    _pools_lock = threading.Lock()
+
+    def _pool(self):
+        size = self.settings_dict.get('POOL_SIZE', 0)
+        if not size or self.is_in_memory_db():
+            return None
+        key = (self.alias, str(self.settings_dict['NAME']))
+        with self._pools_lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = self._pools[key] = queue.LifoQueue(maxsize=size)
+        return pool
+
+    def get_new_connection(self, conn_params):
+        pool = self._pool()
+        if pool is not None:
+            try:
+                return pool.get_nowait()
+            except queue.Empty:
+                pass
+        return super().get_new_connection(conn_params)
+
+    def _close(self):
+        pool = self._pool()
+        if pool is None or self.connection is None or self.in_atomic_block:
+            return super()._close()
+
+        if self.connection.in_transaction:
+            self.connection.rollback()
+        try:
+            pool.put_nowait(self.connection)
+        except queue.Full:
+            super()._close()
@@ -0,0 +1,207 @@
+# bench.py
+import json
+import math
+import os
+import platform
+import random
+import sys
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.contrib.sessions.backends.db import SessionStore
+from django.db.models import Q
+
+from .models import ChatRoom, User
+from .persistence import PendingMessage, write_messages
+
+# Prefix of every user created by the benchmark commands, so their data can be removed.
+BENCH_PREFIX = 'bench-'
+
+# Shape of the Pareto distribution used for skewed message counts; its mean is
+# SKEW_ALPHA / (SKEW_ALPHA - 1), which `seed_bench_data` scales to the requested mean.
+SKEW_ALPHA = 1.5
+
+# Number of messages saved per `write_messages` call while seeding.
+SEED_BATCH_SIZE = 1000
+
+
+def percentile(values, p):
+    """
+    Returns the `p`-th percentile (0-100) of `values` using the nearest-rank method.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def summarize(values, scale=1000):
+    """
+    Summarizes a list of durations in seconds.
+
+    Args:
+        values (list): Durations in seconds.
+        scale (int): Factor applied to every statistic; 1000 reports milliseconds.
+
+    Returns:
+        dict: The count, mean, p50, p95, p99 and max of the values.
+    """
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'mean': sum(values) / len(values) * scale,
+        'p50': percentile(values, 50) * scale,
+        'p95': percentile(values, 95) * scale,
+        'p99': percentile(values, 99) * scale,
+        'max': max(values) * scale,
+    }
+
+
+def make_report(name, config, results):
+    """
+    Wraps benchmark results with the configuration and environment they were measured in.
+    """
+    return {
+        'benchmark': name,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'environment': {
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'config': config,
+        'results': results,
+    }
+
+
+def write_report(report, output, stdout):
+    """
+    Writes a report as JSON to the `output` path, or to `stdout` when no path is given.
+    """
+    text = json.dumps(report, indent=2, default=str)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        stdout.write(text)
+
+
+def create_bench_user(name):
+    """
+    Creates a benchmark user and a logged-in session for it.
+
+    Returns:
+        tuple: The `User` and the value of a `Cookie` header carrying its session.
+    """
+    user = User.objects.create(user_name=f'{BENCH_PREFIX}{name}', password='bench')
+    return user, create_bench_session(user)
+
+
+def create_bench_session(user):
+    """
+    Creates a logged-in session for `user` and returns the `Cookie` header value carrying it.
+    """
+    session = SessionStore()
+    session['token'] = [user.token]
+    session.create()
+    return f'{settings.SESSION_COOKIE_NAME}={session.session_key}'
+
+
+def create_bench_room(user1, user2, **fields):
+    """
+    Creates a chat room between two benchmark users with a fresh data key.
+    """
+    import crypto.crypt
+
+    return ChatRoom.objects.create(
+        user1=user1.user_name,
+        user2=user2.user_name,
+        encryption_key=3,
+        data_key=crypto.crypt.generate_data_key(),
+        **fields
+    )
+
+
+def delete_bench_data():
+    """
+    Deletes every benchmark user and chat room, with their messages.
+    """
+    ChatRoom.objects.filter(
+        Q(user1__startswith=BENCH_PREFIX) | Q(user2__startswith=BENCH_PREFIX)
+    ).delete()
+    User.objects.filter(user_name__startswith=BENCH_PREFIX).delete()
+
+
+def seed_bench_data(users, rooms, messages, distribution='uniform', seed=0):
+    """
+    Fills the database with benchmark users, rooms and encrypted messages.
+
+    Users are bulk-inserted without sessions. Each room joins a distinct pair of users,
+    chosen at random, and its messages alternate between the two participants with
+    increasing timestamps, saved through `write_messages` so the last-message fields are
+    set as in production.
+
+    Args:
+        users (int): Number of users to create; at least 2.
+        rooms (int): Number of rooms to create; at most one per pair of users.
+        messages (int): Mean number of messages per room.
+        distribution (str): 'uniform' gives every room `messages` messages; 'skewed' draws
+            the counts from a Pareto distribution, so a few rooms hold most messages.
+        seed (int): Seed of the random generator, so runs are reproducible.
+
+    Returns:
+        tuple: The created users and rooms, in creation order.
+
+    Raises:
+        ValueError: If the room count cannot be met or the distribution is unknown.
+    """
+    import crypto.crypt
+
+    if distribution not in ('uniform', 'skewed'):
+        raise ValueError(f'Unknown message distribution: {distribution}')
+    if users < 2 or rooms > users * (users - 1) // 2:
+        raise ValueError(f'Cannot create {rooms} distinct rooms between {users} users')
+
+    rng = random.Random(seed)
+    User.objects.bulk_create([
+        User(
+            user_name=f'{BENCH_PREFIX}{i}',
+            user_name_folded=f'{BENCH_PREFIX}{i}',
+            password='bench'
+        )
+        for i in range(users)
+    ])
+    created_users = list(User.objects.filter(user_name__startswith=BENCH_PREFIX).order_by('id'))
+
+    pairs = set()
+    while len(pairs) < rooms:
+        pairs.add(tuple(sorted(rng.sample(range(users), 2))))
+    pairs = sorted(pairs)
+
+    created_rooms = [create_bench_room(created_users[i], created_users[j]) for i, j in pairs]
+
+    start = datetime.now(timezone.utc) - timedelta(days=30)
+    pending = []
+    for room, (i, j) in zip(created_rooms, pairs):
+        if distribution == 'uniform':
+            count = messages
+        else:
+            count = round(messages * rng.paretovariate(SKEW_ALPHA) * (SKEW_ALPHA - 1) / SKEW_ALPHA)
+
+        for n in range(count):
+            pending.append(PendingMessage(
+                room=room,
+                sender=created_users[i if n % 2 == 0 else j],
+                text=crypto.crypt.encrypt(f'bench message {n}', room.data_key),
+                timestamp=start + timedelta(seconds=n)
+            ))
+            if len(pending) >= SEED_BATCH_SIZE:
+                write_messages(pending)
+                pending = []
+    if pending:
+        write_messages(pending)
+
+    for room in created_rooms:
+        room.refresh_from_db()
+    return created_users, created_rooms
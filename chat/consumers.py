@@ -1,27 +1,82 @@
+import asyncio
 import json
-from datetime import datetime
+import time
+from urllib.parse import parse_qs
 
 from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
+from django.db.models import Q
+from django.utils import timezone
 
 import crypto.crypt
-from .models import Message, ChatRoom, User
+from crypto.executor import ExecutorSaturated, crypto_executor
+from . import metrics
+from .profiling import profile_consumer_frames
+from .querylog import record_consumer_queries
+from .models import ChatRoom
+from .persistence import message_writer
+from .utils import get_session_token, get_user_from_token
+
+# Close codes sent when a connection is refused, so clients know not to reconnect: the user
+# is not logged in, or the room does not exist or the user is not one of its participants.
+CLOSE_NOT_AUTHENTICATED = 4401
+CLOSE_ROOM_NOT_FOUND = 4404
+
+# Maximum number of missed messages sent on resume; clients fetch the rest from `sync_room_messages`.
+RESUME_MAX_MESSAGES = 200
+
+# Maximum number of messages preloaded on connect, set from CHAT_WS_HISTORY in `ChatConfig.ready`.
+# With 0, the history frame only carries the room key and clients fetch the messages over HTTP.
+history_max_messages = 50
+
+
+def message_frames(messages, data_key):
+    """
+    Decrypts message dicts from `ChatRoom.messages_since` or `ChatRoom.latest_messages` into
+    the shape sent to clients, with ISO timestamps as in live frames.
+    """
+    contents = crypto.crypt.decrypt_many((message['text'] for message in messages), data_key)
+    return [{
+        'id': message['id'],
+        'sequence': message['sequence'],
+        'sender': message['sender__user_name'],
+        'content': content,
+        'timestamp': message['timestamp'].isoformat()
+    } for message, content in zip(messages, contents)]
 
 
 class ChatConsumer(AsyncWebsocketConsumer):
+    @record_consumer_queries
     async def connect(self):
         """
         Handles the WebSocket connection when a user joins a chat room.
 
         - Extracts the room name from the URL route.
+        - Resolves the user from the session token and the chat room from the room name,
+          once for the whole connection.
+        - Refuses the connection if the user is not logged in or is not a participant of the room:
+          it is accepted and closed right away with `CLOSE_NOT_AUTHENTICATED` or
+          `CLOSE_ROOM_NOT_FOUND`, as a handshake rejection gives the client no close code.
         - Constructs a group name for the chat room based on the room name.
         - Adds the user to the channel group for broadcasting messages.
         - Accepts the WebSocket connection.
+        - If the URL carries `?since=<sequence>`, resumes the connection: sends the messages
+          saved after that sequence in one `sync` frame (see `send_missed_messages`).
+        - Otherwise, if the URL carries `?history=<count>`, sends the room key and the latest
+          messages in one `history` frame (see `send_history`), so the client needs no HTTP
+          request to open the room.
         """
 
         self.room_name = self.scope['url_route']['kwargs']['room_name']
+        self.pending_acks = set()
 
-        self.room_group_name = f'chat_{self.room_name}'
+        self.user, self.room = await self.get_user_and_room(self.room_name)
+        if self.room is None:
+            await self.accept()
+            await self.close(code=CLOSE_NOT_AUTHENTICATED if self.user is None else CLOSE_ROOM_NOT_FOUND)
+            return
+
+        self.room_group_name = f'chat_{self.room.id}'
 
         await self.channel_layer.group_add(
             self.room_group_name,
@@ -29,51 +84,161 @@ class ChatConsumer(AsyncWebsocketConsumer):
         )
 
         await self.accept()
+        if metrics.enabled:
+            metrics.websocket_connections.inc()
+
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        since = query.get('since', [''])[0]
+        history = query.get('history', [''])[0]
+        if since.isdigit():
+            await self.send_missed_messages(int(since))
+        elif history.isdigit():
+            await self.send_history(min(int(history), history_max_messages))
+
+    async def send_history(self, count):
+        """
+        Sends the room key and the `count` latest messages as the first frame of the connection.
+
+        The frame is `{'type': 'history', 'key': ..., 'messages': [...], 'has_more': ...,
+        'last_sequence': ...}`, with messages shaped as in `sync_room_messages`, oldest first;
+        `has_more` tells whether older messages exist. Messages sent while the frame is built
+        may also arrive live; clients recognize them by sender and timestamp. Messages of this
+        process still in the write-behind queue are written first, so they are included.
+
+        Args:
+            count (int): The number of messages to send, already capped at `history_max_messages`.
+        """
+        await message_writer.flush()
+        messages, has_more, last_sequence = await self.get_latest_messages(count)
+        await self.send(text_data=json.dumps({
+            'type': 'history',
+            'key': self.room.encryption_key,
+            'messages': messages,
+            'has_more': has_more,
+            'last_sequence': last_sequence
+        }))
+
+    async def send_missed_messages(self, since):
+        """
+        Sends the messages of the room saved after sequence `since`, as the resume handshake.
+
+        The frame is `{'type': 'sync', 'messages': [...], 'has_more': ..., 'last_sequence': ...}`,
+        with messages shaped as in `sync_room_messages`. The connection already receives live
+        messages, so a message may arrive both live and in the frame; clients recognize it by
+        sender and timestamp. Messages of this process still in the write-behind queue are
+        written first, so they are not missed.
 
+        Args:
+            since (int): The sequence of the last message the client has.
+        """
+        await message_writer.flush()
+        messages, has_more, last_sequence = await self.get_messages_since(since)
+        await self.send(text_data=json.dumps({
+            'type': 'sync',
+            'messages': messages,
+            'has_more': has_more,
+            'last_sequence': last_sequence
+        }))
+
+    @record_consumer_queries
     async def disconnect(self, close_code):
         """
         Handles WebSocket disconnection.
 
         - Removes the user from the chat room group when they disconnect.
+        - Writes any messages still waiting in the write-behind queue.
 
         Args:
             close_code (int): The WebSocket close code indicating why the connection was closed.
         """
+        if self.room is None:
+            return
+
+        if metrics.enabled:
+            metrics.websocket_connections.dec()
+
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
+        await message_writer.flush()
 
+    @record_consumer_queries
+    @profile_consumer_frames
     async def receive(self, text_data):
         """
         Handles receiving messages via WebSocket.
 
         This method is triggered when a message is received from a WebSocket connection.
         It performs the following tasks:
-        1. Parses the incoming JSON data to extract the message, room ID, and sender.
-        2. Retrieves the chat room corresponding to the room ID.
-        3. Saves the received message in the database.
-        4. Broadcasts the message to all participants in the chat room.
+        1. Parses the incoming JSON data to extract the message.
+        2. Encrypts the message on the dedicated `crypto_executor`. If the executor is saturated,
+           the client gets an error frame and the message is neither broadcast nor saved.
+        3. Broadcasts the message to all participants in the chat room right away, as a
+           pre-serialized frame stamped with the time that is also stored on the message row.
+        4. Queues the encrypted message on the write-behind `message_writer`, which saves it in a batch.
+        5. If the client sent a `client_id`, acknowledges the message once it is saved.
+
+        The room and sender are the ones resolved in `connect`; `room_id` and `sender` in the
+        frame are ignored, so no database lookup happens here and the sender cannot be spoofed.
 
         Args:
             text_data (str): The JSON-formatted message received from the WebSocket client.
         """
         text_data_json = json.loads(text_data)
         message = text_data_json['message']
-        room_id = text_data_json['room_id']
-        sender = text_data_json['sender']
+        timestamp = timezone.now()
+
+        try:
+            ciphertext = await crypto_executor.run(crypto.crypt.encrypt, message, self.room.data_key)
+        except ExecutorSaturated:
+            await self.send(text_data=json.dumps({
+                'type': 'error',
+                'error': 'Server busy, message not sent',
+                'client_id': text_data_json.get('client_id')
+            }))
+            return
 
-        room = await self.get_room(room_id)
-        await self.save_message(room, sender, message)
+        # The outbound frame is encoded once here; every member just writes it to its socket.
+        sent_at = time.time()
         await self.channel_layer.group_send(
             self.room_group_name,
             {
                 'type': 'chat_message',
-                'message': message,
-                'sender': sender,
-                'timestamp': str(datetime.now())
+                'text': json.dumps({
+                    'message': message,
+                    'sender': self.user.user_name,
+                    'timestamp': timestamp.isoformat()
+                }),
+                'sent_at': sent_at
             }
         )
+        if metrics.enabled:
+            metrics.group_send_duration.observe(time.time() - sent_at)
+
+        saved = message_writer.submit(self.room, self.user, ciphertext, timestamp)
+        if 'client_id' in text_data_json:
+            task = asyncio.create_task(self.acknowledge(saved, text_data_json['client_id']))
+            self.pending_acks.add(task)
+            task.add_done_callback(self.pending_acks.discard)
+
+    async def acknowledge(self, saved, client_id):
+        """
+        Tells the sender that one of its messages has been saved.
+
+        Sends `{'type': 'ack', 'client_id': ..., 'id': ...}` once the write-behind queue has
+        committed the message, with `'id': None` if it could not be saved.
+
+        Args:
+            saved (asyncio.Future): The future returned by `message_writer.submit`.
+            client_id: The identifier the client attached to the message.
+        """
+        message = await saved
+        await self.send(text_data=json.dumps({
+            'type': 'ack',
+            'client_id': client_id,
+            'id': message.id if message else None
+        }))
 
     async def chat_message(self, event):
         """
@@ -84,62 +249,75 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
         Args:
             event (dict): The event dictionary containing the following keys:
-                - 'message': The content of the message being broadcast.
-                - 'sender': The username of the sender.
-                - 'timestamp': The time the message was sent.
+                - 'text': The WebSocket frame, already JSON-encoded by the sender, with the
+                  message content, the sender's username and the timestamp stored on the
+                  message row.
+                - 'sent_at': The sender's `time.time()` when it called `group_send`, used to
+                  record the fan-out latency.
         """
-
-        message = event['message']
-        sender = event['sender']
-        timestamp = event['timestamp']
-
-        await self.send(text_data=json.dumps({
-            'message': message,
-            'sender': sender,
-            'timestamp': timestamp
-        }))
+        if metrics.enabled and 'sent_at' in event:
+            metrics.fanout_latency.observe(time.time() - event['sent_at'])
+        await self.send(text_data=event['text'])
 
     @database_sync_to_async
-    def get_room(self, room_id):
+    def get_user_and_room(self, room_name):
         """
-        Retrieves the chat room from the database by its ID.
+        Resolves the connecting user and the chat room they are joining.
+
+        The user comes from the session token in the connection scope. The room must exist
+        and have the user as one of its two participants; its data key is created here if
+        needed, so messages can be encrypted without touching the database.
 
         This method is decorated with `@database_sync_to_async` to ensure that
-        the database query runs asynchronously, preventing blocking of the event loop.
+        the database queries run asynchronously, preventing blocking of the event loop.
 
         Args:
-            room_id (int): The ID of the chat room to be retrieved.
+            room_name (str): The room name from the URL route, i.e. the chat room ID.
 
         Returns:
-            ChatRoom: The chat room instance that matches the given room_id.
-
-        Raises:
-            ChatRoom.DoesNotExist: If no chat room with the provided ID is found.
+            tuple: The `User` and `ChatRoom`, with None in place of the room (and possibly
+            the user) when the connection must be rejected.
         """
-        return ChatRoom.objects.get(id=room_id)
+        session = self.scope.get('session')
+        user = get_user_from_token(get_session_token(session)) if session is not None else None
+        if user is None or not room_name.isdigit():
+            return user, None
+
+        room = ChatRoom.objects.filter(
+            Q(user1=user.user_name) | Q(user2=user.user_name),
+            id=int(room_name)
+        ).first()
+        if room is not None:
+            room.get_data_key()
+        return user, room
 
     @database_sync_to_async
-    def save_message(self, room, sender, message):
+    def get_messages_since(self, since):
         """
-        Saves a new message to the database.
+        Reads and decrypts at most `RESUME_MAX_MESSAGES` messages saved after sequence `since`.
 
-        This method retrieves the user by their username (sender) and creates a new
-        message linked to the specified chat room. The message is saved to the `Message` model.
+        Returns:
+            tuple: The message dicts, whether more messages follow them, and the room's last sequence.
+        """
+        last_sequence = ChatRoom.objects.filter(id=self.room.id).values_list('last_sequence', flat=True).get()
+        if since >= last_sequence:
+            return [], False, last_sequence
 
-        Args:
-            room (ChatRoom): The chat room where the message is being sent.
-            sender (str): The username of the sender of the message.
-            message (str): The text content of the message to be saved.
+        messages, has_more = self.room.messages_since(since, RESUME_MAX_MESSAGES)
+        return message_frames(messages, self.room.data_key), has_more, last_sequence
 
-        Returns:
-            None: If the sender does not exist or the message fails to save.
+    @database_sync_to_async
+    def get_latest_messages(self, count):
         """
-        from django.core.exceptions import ObjectDoesNotExist
+        Reads and decrypts the `count` latest messages of the room.
 
-        try:
-            user = User.objects.get(user_name=sender)
-        except ObjectDoesNotExist:
-            return
+        Returns:
+            tuple: The message dicts, whether older messages exist, and the room's last sequence.
+        """
+        if count == 0:
+            last_sequence = ChatRoom.objects.filter(id=self.room.id).values_list('last_sequence', flat=True).get()
+            return [], last_sequence > 0, last_sequence
 
-        new_message = Message(room=room, sender=user, text=crypto.crypt.encrypt(message))
-        new_message.save()
+        messages, has_more = self.room.latest_messages(count)
+        last_sequence = messages[-1]['sequence'] if messages else 0
+        return message_frames(messages, self.room.data_key), has_more, last_sequence
@@ -0,0 +1,364 @@
+# layers.py
+import asyncio
+import base64
+import json
+import random
+import sqlite3
+import string
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS channel_messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS channel_messages_channel_idx ON channel_messages (channel, id);
+CREATE TABLE IF NOT EXISTS channel_groups (
+    grp TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    joined_at REAL NOT NULL,
+    PRIMARY KEY (grp, channel)
+);
+CREATE INDEX IF NOT EXISTS channel_groups_channel_idx ON channel_groups (channel);
+"""
+
+# Maximum number of channel names bound into a single polling query.
+POLL_BATCH_SIZE = 500
+
+
+@contextmanager
+def _immediate_transaction(db):
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        yield
+    except BaseException:
+        db.execute('ROLLBACK')
+        raise
+    db.execute('COMMIT')
+
+
+def _encode(message):
+    return json.dumps(message, default=_encode_bytes)
+
+
+def _encode_bytes(value):
+    if isinstance(value, bytes):
+        return {'__bytes__': base64.b64encode(value).decode()}
+    raise TypeError(f'Object of type {type(value).__name__} is not serializable by the channel layer')
+
+
+def _decode(payload):
+    return json.loads(payload, object_hook=_decode_bytes)
+
+
+def _decode_bytes(value):
+    if len(value) == 1 and '__bytes__' in value:
+        return base64.b64decode(value['__bytes__'])
+    return value
+
+
+class _ReceiveState:
+    """
+    Per-event-loop receive state: local buffers of fetched messages, the channels that
+    currently have a waiting `receive`, and the task polling the database for them.
+    """
+
+    def __init__(self):
+        self.buffers = {}
+        self.waiting = Counter()
+        self.poller = None
+
+
+class SQLiteChannelLayer(BaseChannelLayer):
+    """
+    Channel layer that shares channels and groups between processes through a SQLite file.
+
+    Every process (e.g. several daphne workers on one box) opens the same database in WAL
+    mode, so `group_send` reaches sockets held by any of them without an external broker.
+    Messages expire after `expiry` seconds and group memberships after `group_expiry`
+    seconds; a channel whose message expires is removed from its groups, like the in-memory
+    layer does. A channel holding `capacity` pending messages raises `ChannelFull`.
+
+    Each process runs one polling task per event loop that fetches messages for all of
+    its waiting channels in one query, backing off from `poll_interval` to
+    `max_poll_interval` while idle. Database access runs on a dedicated thread so it never
+    blocks the event loop.
+
+    Configured through CHANNEL_LAYERS, e.g.::
+
+        "BACKEND": "chat.layers.SQLiteChannelLayer",
+        "CONFIG": {"path": BASE_DIR / "channels.sqlite3"},
+    """
+
+    extensions = ['groups', 'flush']
+
+    def __init__(
+        self,
+        path,
+        expiry=60,
+        group_expiry=86400,
+        capacity=100,
+        channel_capacity=None,
+        poll_interval=0.005,
+        max_poll_interval=0.05,
+        **kwargs,
+    ):
+        super().__init__(expiry=expiry, capacity=capacity, **kwargs)
+        self.channel_capacity = self.compile_capacities(channel_capacity or {})
+        self.path = str(path)
+        self.group_expiry = group_expiry
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite-channel-layer')
+        self._connection = None
+        self._last_cleanup = 0
+        self._receive_states = {}
+
+    # Channel layer API
+
+    async def send(self, channel, message):
+        """
+        Send a message onto a (general or specific) channel.
+        """
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_channel_name(channel)
+        assert '__asgi_channel__' not in message
+
+        if not await self._run(self._send, channel, _encode(message), self.get_capacity(channel)):
+            raise ChannelFull(channel)
+
+    async def receive(self, channel):
+        """
+        Receive the first message that arrives on the channel, from any process.
+        """
+        self.require_valid_channel_name(channel)
+
+        state = self._receive_state()
+        queue = state.buffers.setdefault(channel, asyncio.Queue())
+        state.waiting[channel] += 1
+        if state.poller is None:
+            state.poller = asyncio.create_task(self._poll(state))
+
+        try:
+            return await queue.get()
+        finally:
+            state.waiting[channel] -= 1
+            if not state.waiting[channel]:
+                del state.waiting[channel]
+                if queue.empty():
+                    state.buffers.pop(channel, None)
+
+    async def new_channel(self, prefix='specific.'):
+        """
+        Returns a new channel name that can be used by something in our
+        process as a specific channel.
+        """
+        return '%s.sqlite!%s' % (
+            prefix,
+            ''.join(random.choice(string.ascii_letters) for _ in range(12)),
+        )
+
+    # Flush extension
+
+    async def flush(self):
+        await self._run(self._flush)
+        self._receive_states.clear()
+
+    async def close(self):
+        await self._run(self._close)
+
+    # Groups extension
+
+    async def group_add(self, group, channel):
+        """
+        Adds the channel name to a group, or refreshes its membership.
+        """
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        await self._run(self._group_add, group, channel)
+
+    async def group_discard(self, group, channel):
+        self.require_valid_channel_name(channel)
+        self.require_valid_group_name(group)
+        await self._run(self._group_discard, group, channel)
+
+    async def group_send(self, group, message):
+        """
+        Sends a message to every channel in the group, skipping channels that are full.
+        """
+        assert isinstance(message, dict), 'Message is not a dict'
+        self.require_valid_group_name(group)
+        await self._run(self._group_send, group, _encode(message))
+
+    # Monitoring
+
+    def stats(self):
+        """
+        Returns the number of pending messages and the size of every group.
+
+        Uses its own short-lived connection, so it can be called from any thread.
+
+        Returns:
+            dict: `queue_depth` (unexpired messages waiting in any channel) and `groups`
+            (group name to number of member channels).
+        """
+        now = time.time()
+        db = sqlite3.connect(self.path, timeout=10)
+        try:
+            (queue_depth,) = db.execute(
+                'SELECT COUNT(*) FROM channel_messages WHERE expires_at > ?', (now,)
+            ).fetchone()
+            groups = dict(db.execute(
+                'SELECT grp, COUNT(*) FROM channel_groups WHERE joined_at > ? GROUP BY grp',
+                (now - self.group_expiry,)
+            ).fetchall())
+        except sqlite3.OperationalError:
+            # No process has used the layer yet, so the tables do not exist.
+            queue_depth, groups = 0, {}
+        finally:
+            db.close()
+        return {'queue_depth': queue_depth, 'groups': groups}
+
+    # Receiving
+
+    def _receive_state(self):
+        loop = asyncio.get_running_loop()
+        state = self._receive_states.get(loop)
+        if state is None:
+            state = self._receive_states[loop] = _ReceiveState()
+        return state
+
+    async def _poll(self, state):
+        interval = self.poll_interval
+        try:
+            while state.waiting:
+                rows = await self._run(self._fetch, list(state.waiting))
+                for channel, payload in rows:
+                    state.buffers.setdefault(channel, asyncio.Queue()).put_nowait(_decode(payload))
+
+                if rows:
+                    interval = self.poll_interval
+                else:
+                    await asyncio.sleep(interval)
+                    interval = min(interval * 2, self.max_poll_interval)
+        finally:
+            state.poller = None
+            if not state.buffers:
+                self._receive_states.pop(asyncio.get_running_loop(), None)
+
+    # Database access, always on the layer's own thread
+
+    def _run(self, func, *args):
+        return asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _db(self):
+        if self._connection is None:
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(SCHEMA)
+            self._connection = connection
+        return self._connection
+
+    def _send(self, channel, payload, capacity):
+        db = self._db()
+        now = time.time()
+        with _immediate_transaction(db):
+            return self._insert(db, channel, payload, capacity, now)
+
+    def _insert(self, db, channel, payload, capacity, now):
+        (pending,) = db.execute(
+            'SELECT COUNT(*) FROM channel_messages WHERE channel = ? AND expires_at > ?',
+            (channel, now)
+        ).fetchone()
+        if pending >= capacity:
+            return False
+        db.execute(
+            'INSERT INTO channel_messages (channel, payload, expires_at) VALUES (?, ?, ?)',
+            (channel, payload, now + self.expiry)
+        )
+        return True
+
+    def _fetch(self, channels):
+        """
+        Claims the pending messages of `channels`.
+
+        Reads without a transaction first, so an idle poll never takes the write lock that
+        every `send` and `group_send` needs. The write transaction is only opened when there
+        are messages to delete or the expiry sweep is due; a message is returned only if
+        this call's delete removed it, so no two receivers get the same message.
+        """
+        db = self._db()
+        now = time.time()
+        rows = []
+        for start in range(0, len(channels), POLL_BATCH_SIZE):
+            batch = channels[start:start + POLL_BATCH_SIZE]
+            placeholders = ', '.join('?' * len(batch))
+            rows.extend(db.execute(
+                f'SELECT id, channel, payload FROM channel_messages '
+                f'WHERE channel IN ({placeholders}) AND expires_at > ? ORDER BY id',
+                (*batch, now)
+            ).fetchall())
+
+        cleanup_due = now - self._last_cleanup > 1
+        if not rows and not cleanup_due:
+            return []
+
+        with _immediate_transaction(db):
+            if cleanup_due:
+                self._clean_expired(db, now)
+                self._last_cleanup = now
+            rows = [
+                row for row in rows
+                if db.execute('DELETE FROM channel_messages WHERE id = ?', (row[0],)).rowcount
+            ]
+
+        rows.sort()
+        return [(channel, payload) for _, channel, payload in rows]
+
+    def _clean_expired(self, db, now):
+        db.execute(
+            'DELETE FROM channel_groups WHERE channel IN '
+            '(SELECT channel FROM channel_messages WHERE expires_at <= ?)',
+            (now,)
+        )
+        db.execute('DELETE FROM channel_messages WHERE expires_at <= ?', (now,))
+        db.execute('DELETE FROM channel_groups WHERE joined_at <= ?', (now - self.group_expiry,))
+
+    def _group_add(self, group, channel):
+        self._db().execute(
+            'INSERT OR REPLACE INTO channel_groups (grp, channel, joined_at) VALUES (?, ?, ?)',
+            (group, channel, time.time())
+        )
+
+    def _group_discard(self, group, channel):
+        self._db().execute('DELETE FROM channel_groups WHERE grp = ? AND channel = ?', (group, channel))
+
+    def _group_send(self, group, payload):
+        db = self._db()
+        now = time.time()
+        with _immediate_transaction(db):
+            channels = db.execute(
+                'SELECT channel FROM channel_groups WHERE grp = ? AND joined_at > ?',
+                (group, now - self.group_expiry)
+            ).fetchall()
+            for (channel,) in channels:
+                self._insert(db, channel, payload, self.get_capacity(channel), now)
+
+    def _flush(self):
+        db = self._db()
+        db.execute('DELETE FROM channel_messages')
+        db.execute('DELETE FROM channel_groups')
+
+    def _close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
@@ -0,0 +1,179 @@
+import json
+import os
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import ExitStack
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+
+from chat.bench import (
+    create_bench_session, delete_bench_data, make_report, seed_bench_data, summarize, write_report
+)
+from chat.middleware import QueryTimer
+from chat.models import User
+
+# Baselines checked by default; regenerate them with --update-baselines.
+DEFAULT_BASELINES = os.path.join(os.path.dirname(__file__), '..', '..', 'bench_baselines.json')
+
+# Host header sent by the benchmark clients; allowed by the DEBUG default of ALLOWED_HOSTS.
+BENCH_HOST = 'localhost'
+
+
+class Command(BaseCommand):
+    help = (
+        'Seeds benchmark data and measures latency, query count and allocated memory per request '
+        'for get_room_messages, get_user_chat_rooms, search_user and login. Fails when an endpoint '
+        'runs more queries than its stored baseline or its p95 latency exceeds the baseline by '
+        'more than the tolerance.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200, help='Number of users to seed.')
+        parser.add_argument('--rooms', type=int, default=400, help='Number of rooms to seed.')
+        parser.add_argument('--messages', type=int, default=100, help='Mean number of messages per room.')
+        parser.add_argument('--distribution', choices=['uniform', 'skewed'], default='skewed',
+                            help='How messages are spread over rooms.')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the generated data.')
+        parser.add_argument('--iterations', type=int, default=200, help='Timed requests per endpoint.')
+        parser.add_argument('--warmup', type=int, default=20, help='Untimed requests per endpoint.')
+        parser.add_argument('--baselines', default=DEFAULT_BASELINES, help='JSON file of stored baselines.')
+        parser.add_argument('--tolerance', type=float, default=0.5,
+                            help='Allowed p95 latency growth over the baseline, as a fraction.')
+        parser.add_argument('--update-baselines', action='store_true',
+                            help='Store this run as the new baselines instead of checking them.')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout.')
+        parser.add_argument('--keep', action='store_true', help='Keep the benchmark users, rooms and messages.')
+
+    def handle(self, *args, **options):
+        delete_bench_data()
+        try:
+            report = self.run(options)
+        finally:
+            if not options['keep']:
+                delete_bench_data()
+        write_report(report, options['output'], self.stdout)
+
+        if options['update_baselines']:
+            self.save_baselines(options['baselines'], report['results'])
+        else:
+            regressions = self.check_baselines(options['baselines'], options['tolerance'], report['results'])
+            if regressions:
+                raise CommandError('Benchmark regressions:\n' + '\n'.join(regressions))
+
+    def run(self, options):
+        users, rooms = seed_bench_data(
+            options['users'], options['rooms'], options['messages'], options['distribution'], options['seed']
+        )
+
+        # Probe as the busiest user, reading their largest room and searching for a partner.
+        participation = Counter(name for room in rooms for name in (room.user1, room.user2))
+        probe = User.objects.get(user_name=participation.most_common(1)[0][0])
+        probe_rooms = [room for room in rooms if probe.user_name in (room.user1, room.user2)]
+        history_room = max(probe_rooms, key=lambda room: room.message_set.count())
+        partner = history_room.user2 if history_room.user1 == probe.user_name else history_room.user1
+
+        client = Client(HTTP_HOST=BENCH_HOST, HTTP_COOKIE=create_bench_session(probe))
+        login_user = next(user for user in users if user.id != probe.id and user.user_name != partner)
+
+        endpoints = {
+            'get_room_messages': lambda: client.get(f'/get_room_messages/{history_room.id}/'),
+            'get_user_chat_rooms': lambda: client.get('/get_user_chat_rooms'),
+            'search_user': lambda: client.post(
+                '/search_user/', {'username': partner}, headers={'x-requested-with': 'XMLHttpRequest'}
+            ),
+            'login': lambda: Client(HTTP_HOST=BENCH_HOST).post(
+                '/login', {'user_name': login_user.user_name, 'password': 'bench', 'method': 'log'}
+            ),
+        }
+
+        results = {
+            name: self.measure(name, request, options['iterations'], options['warmup'])
+            for name, request in endpoints.items()
+        }
+        results['data'] = {
+            'probe_rooms': len(probe_rooms),
+            'history_room_messages': history_room.message_set.count(),
+        }
+
+        return make_report('bench_http', {
+            key: options[key] for key in ('users', 'rooms', 'messages', 'distribution', 'seed', 'iterations')
+        }, results)
+
+    def measure(self, name, request, iterations, warmup):
+        """
+        Times `request` and records its query count and peak allocated memory.
+
+        Queries are counted on every database alias, so reads routed to the replica count too.
+        Memory is traced on separate requests so tracing does not skew the timings.
+        """
+        for _ in range(warmup):
+            self.check_response(name, request())
+
+        timings, query_counts = [], []
+        for _ in range(iterations):
+            queries = QueryTimer()
+            with ExitStack() as stack:
+                for db in connections.all():
+                    stack.enter_context(db.execute_wrapper(queries))
+                started = time.perf_counter()
+                response = request()
+                timings.append(time.perf_counter() - started)
+            self.check_response(name, response)
+            query_counts.append(queries.count)
+
+        allocations = []
+        tracemalloc.start()
+        try:
+            for _ in range(max(1, iterations // 10)):
+                tracemalloc.reset_peak()
+                before, _ = tracemalloc.get_traced_memory()
+                request()
+                allocations.append(tracemalloc.get_traced_memory()[1] - before)
+        finally:
+            tracemalloc.stop()
+
+        return {
+            'latency_ms': summarize(timings),
+            'queries': max(query_counts),
+            'peak_allocated_bytes': max(allocations),
+        }
+
+    @staticmethod
+    def check_response(name, response):
+        if response.status_code >= 400:
+            raise CommandError(f'{name} returned HTTP {response.status_code}')
+
+    @staticmethod
+    def check_baselines(path, tolerance, results):
+        """
+        Compares results with the stored baselines.
+
+        Returns:
+            list: A description of every endpoint over its query or latency baseline.
+        """
+        if not os.path.exists(path):
+            raise CommandError(f'No baselines at {path}; run with --update-baselines first')
+        with open(path) as f:
+            baselines = json.load(f)
+
+        regressions = []
+        for name, baseline in baselines.items():
+            result = results[name]
+            if result['queries'] > baseline['queries']:
+                regressions.append(f"{name}: {result['queries']} queries, baseline {baseline['queries']}")
+            p95 = result['latency_ms']['p95']
+            if p95 > baseline['p95_ms'] * (1 + tolerance):
+                regressions.append(f"{name}: p95 {p95:.2f} ms, baseline {baseline['p95_ms']:.2f} ms")
+        return regressions
+
+    @staticmethod
+    def save_baselines(path, results):
+        baselines = {
+            name: {'queries': result['queries'], 'p95_ms': round(result['latency_ms']['p95'], 2)}
+            for name, result in results.items() if 'queries' in result
+        }
+        with open(path, 'w') as f:
+            f.write(json.dumps(baselines, indent=2) + '\n')
@@ -0,0 +1,240 @@
+import asyncio
+import base64
+import json
+import os
+import struct
+import time
+import tracemalloc
+from urllib.parse import urlparse
+
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.bench import create_bench_room, create_bench_user, delete_bench_data, make_report, summarize, write_report
+from chat.models import Message
+
+# Marks benchmark payloads; the rest of the message is the send time on the benchmark's clock.
+PAYLOAD_PREFIX = 'bench '
+
+
+class InProcessClient:
+    """
+    A WebSocket client talking to the ASGI application in this process.
+    """
+
+    def __init__(self, application, path, cookie):
+        self.communicator = WebsocketCommunicator(application, path, headers=[(b'cookie', cookie.encode())])
+
+    async def connect(self):
+        connected, _ = await self.communicator.connect()
+        if not connected:
+            raise CommandError('WebSocket connection was rejected')
+
+    async def send(self, text):
+        await self.communicator.send_to(text_data=text)
+
+    async def receive(self):
+        return await self.communicator.receive_from(timeout=3600)
+
+    async def close(self):
+        await self.communicator.disconnect()
+
+
+class SocketClient:
+    """
+    A minimal RFC 6455 client talking to a running server (e.g. daphne) over a real socket.
+
+    Written on asyncio streams because the twisted-based clients shipped with daphne cannot
+    run on the benchmark's asyncio loop.
+    """
+
+    def __init__(self, url, cookie):
+        self.url = urlparse(url)
+        self.cookie = cookie
+        self.reader = None
+        self.writer = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.url.hostname, self.url.port or 80)
+        key = base64.b64encode(os.urandom(16)).decode()
+        self.writer.write((
+            f'GET {self.url.path} HTTP/1.1\r\n'
+            f'Host: {self.url.netloc}\r\n'
+            'Upgrade: websocket\r\n'
+            'Connection: Upgrade\r\n'
+            f'Sec-WebSocket-Key: {key}\r\n'
+            'Sec-WebSocket-Version: 13\r\n'
+            f'Cookie: {self.cookie}\r\n'
+            '\r\n'
+        ).encode())
+        response = await self.reader.readuntil(b'\r\n\r\n')
+        if not response.startswith(b'HTTP/1.1 101'):
+            raise CommandError(f'WebSocket connection was rejected: {response.splitlines()[0].decode()}')
+
+    async def send(self, text):
+        self.writer.write(self._frame(0x1, text.encode()))
+
+    async def receive(self):
+        while True:
+            opcode, payload = await self._read_frame()
+            if opcode == 0x1:
+                return payload.decode()
+            if opcode == 0x9:
+                self.writer.write(self._frame(0xA, payload))
+            elif opcode == 0x8:
+                raise ConnectionError('WebSocket closed by the server')
+
+    async def close(self):
+        self.writer.write(self._frame(0x8, struct.pack('!H', 1000)))
+        self.writer.close()
+
+    @staticmethod
+    def _frame(opcode, payload):
+        mask = os.urandom(4)
+        length = len(payload)
+        if length < 126:
+            header = struct.pack('!BB', 0x80 | opcode, 0x80 | length)
+        elif length < 1 << 16:
+            header = struct.pack('!BBH', 0x80 | opcode, 0x80 | 126, length)
+        else:
+            header = struct.pack('!BBQ', 0x80 | opcode, 0x80 | 127, length)
+        masked = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        return header + mask + masked
+
+    async def _read_frame(self):
+        first, second = await self.reader.readexactly(2)
+        length = second & 0x7F
+        if length == 126:
+            (length,) = struct.unpack('!H', await self.reader.readexactly(2))
+        elif length == 127:
+            (length,) = struct.unpack('!Q', await self.reader.readexactly(8))
+        return first & 0x0F, await self.reader.readexactly(length)
+
+
+def read_rss(pid):
+    """
+    Returns the resident set size of a process in bytes, from /proc.
+    """
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) * 1024
+    return None
+
+
+class Command(BaseCommand):
+    help = (
+        'Load-tests ChatConsumer with N rooms x M clients sending at a fixed rate, either '
+        'in-process through WebsocketCommunicator or against a running server, and reports '
+        'throughput, end-to-end latency percentiles, DB write rate and memory per connection as JSON.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rooms', type=int, default=10, help='Number of chat rooms.')
+        parser.add_argument('--clients', type=int, default=2, help='Connected clients per room.')
+        parser.add_argument('--rate', type=float, default=1.0, help='Messages per second sent by each client.')
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds to keep sending.')
+        parser.add_argument('--drain', type=float, default=2.0, help='Seconds to wait for in-flight messages.')
+        parser.add_argument('--server', help='Base WebSocket URL of a running server, e.g. ws://127.0.0.1:8000. '
+                                             'Without it the ASGI application runs in this process.')
+        parser.add_argument('--server-pid', type=int, help='PID of the server, to measure its memory per connection.')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout.')
+        parser.add_argument('--keep', action='store_true', help='Keep the benchmark users, rooms and messages.')
+
+    def handle(self, *args, **options):
+        delete_bench_data()
+        try:
+            report = self.run(options)
+        finally:
+            if not options['keep']:
+                delete_bench_data()
+        write_report(report, options['output'], self.stdout)
+
+    def run(self, options):
+        rooms, clients = [], []
+        for r in range(options['rooms']):
+            (user1, cookie1), (user2, cookie2) = create_bench_user(f'{r}-a'), create_bench_user(f'{r}-b')
+            room = create_bench_room(user1, user2)
+            rooms.append(room)
+            for c in range(options['clients']):
+                clients.append(self.make_client(options, room, cookie1 if c % 2 == 0 else cookie2))
+
+        started = time.monotonic()
+        results = asyncio.run(self.drive(options, clients))
+        elapsed = time.monotonic() - started
+
+        written = Message.objects.filter(room__in=rooms).count()
+        results['db_writes'] = written
+        results['db_writes_per_second'] = written / elapsed
+
+        return make_report('bench_ws', {
+            key: options[key] for key in ('rooms', 'clients', 'rate', 'duration', 'drain', 'server')
+        }, results)
+
+    def make_client(self, options, room, cookie):
+        if options['server']:
+            return SocketClient(f"{options['server'].rstrip('/')}/ws/chat/{room.id}/", cookie)
+
+        from chattyfast.asgi import application
+        return InProcessClient(application, f'/ws/chat/{room.id}/', cookie)
+
+    async def drive(self, options, clients):
+        in_process = not options['server']
+        rss_before = read_rss(options['server_pid']) if options['server_pid'] else None
+        if in_process:
+            tracemalloc.start()
+
+        await asyncio.gather(*(client.connect() for client in clients))
+
+        memory = {}
+        if in_process:
+            memory['traced_bytes_per_connection'] = tracemalloc.get_traced_memory()[0] / len(clients)
+            tracemalloc.stop()
+        if rss_before is not None:
+            memory['server_rss_bytes_per_connection'] = (read_rss(options['server_pid']) - rss_before) / len(clients)
+
+        latencies = []
+        sent = [0]
+        deadline = time.perf_counter() + options['duration']
+
+        async def send_loop(client):
+            interval = 1 / options['rate']
+            next_send = time.perf_counter()
+            while next_send < deadline:
+                await client.send(json.dumps({
+                    'message': f'{PAYLOAD_PREFIX}{time.perf_counter():.9f}',
+                    'client_id': sent[0]
+                }))
+                sent[0] += 1
+                next_send += interval
+                await asyncio.sleep(max(0.0, next_send - time.perf_counter()))
+
+        async def receive_loop(client):
+            while True:
+                frame = json.loads(await client.receive())
+                message = frame.get('message', '')
+                if message.startswith(PAYLOAD_PREFIX):
+                    latencies.append(time.perf_counter() - float(message[len(PAYLOAD_PREFIX):]))
+
+        receivers = [asyncio.create_task(receive_loop(client)) for client in clients]
+        send_started = time.perf_counter()
+        await asyncio.gather(*(send_loop(client) for client in clients))
+        send_elapsed = time.perf_counter() - send_started
+        await asyncio.sleep(options['drain'])
+
+        for task in receivers:
+            task.cancel()
+        await asyncio.gather(*receivers, return_exceptions=True)
+        await asyncio.gather(*(client.close() for client in clients))
+        if not in_process:
+            await asyncio.sleep(options['drain'])
+
+        return {
+            'connections': len(clients),
+            'messages_sent': sent[0],
+            'messages_delivered': len(latencies),
+            'send_rate_per_second': sent[0] / send_elapsed,
+            'delivery_rate_per_second': len(latencies) / (send_elapsed + options['drain']),
+            'latency_ms': summarize(latencies),
+            'memory': memory,
+        }
@@ -0,0 +1,364 @@
+# metrics.py
+import bisect
+import math
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Default histogram buckets in seconds, from 100 µs to 10 s.
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class _Values:
+    """
+    The accumulated values of one metric, keyed by label values.
+
+    A single dict behind a lock: storage grows with the number of label combinations only,
+    however many threads update the metric, and an update holds the lock for one addition.
+    """
+
+    def __init__(self):
+        self._values = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def add(self, key, amount):
+        with self._lock:
+            self._values[key] += amount
+
+    def add_all(self, items):
+        """
+        Adds several `(key, amount)` pairs at once, so a reader sees all of them or none.
+        """
+        with self._lock:
+            for key, amount in items:
+                self._values[key] += amount
+
+    def totals(self):
+        with self._lock:
+            return dict(self._values)
+
+
+class Metric:
+    """
+    Base class of the metric types.
+
+    Attributes:
+        name (str): The metric name, as exposed on `/metrics`.
+        help (str): One-line description, exposed as `# HELP`.
+        labelnames (tuple): Names of the labels every update must pass as keyword arguments.
+    """
+    type = None
+
+    def __init__(self, name, help, labelnames=(), collect=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+        self._values = _Values()
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """
+        Returns the metric's current samples as `(suffix, labels, value)` tuples.
+
+        Metrics given a `collect` callable, returning a dict of label tuples to values, are
+        computed from it when collected instead of being updated.
+        """
+        values = self.collect() if self.collect is not None else self._values.totals()
+        return [(self.name, dict(zip(self.labelnames, key)), value) for key, value in sorted(values.items())]
+
+
+class Counter(Metric):
+    """
+    A monotonically increasing value, e.g. a number of requests.
+    """
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        self._values.add(self._key(labels), amount)
+
+
+class Gauge(Metric):
+    """
+    A value that goes up and down, e.g. a number of open connections.
+
+    Either updated with `inc` / `dec`, or computed when collected by `collect`.
+    """
+    type = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        self._values.add(self._key(labels), amount)
+
+    def dec(self, amount=1, **labels):
+        self._values.add(self._key(labels), -amount)
+
+
+class Histogram(Metric):
+    """
+    Counts observed values (usually durations in seconds) in cumulative buckets.
+    """
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        self._values.add_all(((key + (bisect.bisect_left(self.buckets, value),), 1), (key + ('sum',), value)))
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observes the time spent in the `with` block.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        series = defaultdict(lambda: [0] * (len(self.buckets) + 1))
+        sums = defaultdict(float)
+        for key, value in self._values.totals().items():
+            *label_values, slot = key
+            if slot == 'sum':
+                sums[tuple(label_values)] += value
+            else:
+                series[tuple(label_values)][slot] += value
+
+        samples = []
+        for key in sorted(series):
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), series[key]):
+                cumulative += count
+                samples.append((f'{self.name}_bucket', {**labels, 'le': _format_value(bound)}, cumulative))
+            samples.append((f'{self.name}_sum', labels, sums[key]))
+            samples.append((f'{self.name}_count', labels, cumulative))
+        return samples
+
+
+class Registry:
+    """
+    The set of metrics exposed by this process.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """
+        Adds a metric and returns it.
+
+        Raises:
+            ValueError: If a metric with the same name is already registered.
+        """
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f'Duplicate metric: {metric.name}')
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=(), collect=None):
+        return self.register(Counter(name, help, labelnames, collect))
+
+    def gauge(self, name, help, labelnames=(), collect=None):
+        return self.register(Gauge(name, help, labelnames, collect))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def render(self):
+        """
+        Returns every metric in the Prometheus text exposition format.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(
+        '%s="%s"' % (name, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels.items()
+    )
+    return '{%s}' % pairs
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def channel_layer_stats():
+    """
+    Returns the queue depth and group sizes of the default channel layer, as seen by this process.
+
+    Returns:
+        dict: `queue_depth` (messages waiting in channels) and `groups` (group name to number
+        of channels), or None when the layer cannot be inspected.
+    """
+    from channels.layers import InMemoryChannelLayer, get_channel_layer
+
+    from .layers import SQLiteChannelLayer
+
+    layer = get_channel_layer()
+    if isinstance(layer, SQLiteChannelLayer):
+        return layer.stats()
+    if isinstance(layer, InMemoryChannelLayer):
+        return {
+            'queue_depth': sum(queue.qsize() for queue in list(layer.channels.values())),
+            'groups': {group: len(channels) for group, channels in list(layer.groups.items())},
+        }
+    return None
+
+
+def _collect_channel_layer(field):
+    def collect():
+        stats = channel_layer_stats()
+        if stats is None:
+            return {}
+        groups = stats['groups']
+        values = {
+            'queue_depth': stats['queue_depth'],
+            'groups': len(groups),
+            'group_members': sum(groups.values()),
+            'largest_group': max(groups.values(), default=0),
+        }
+        return {(): values[field]}
+    return collect
+
+
+def _collect_stats(stats, field):
+    """
+    Returns a `collect` callable reading one field of the dict returned by `stats()`.
+    """
+    def collect():
+        return {(): stats()[field]}
+    return collect
+
+
+def _crypto_executor_stats():
+    from crypto.executor import crypto_executor
+
+    return crypto_executor.stats()
+
+
+def _plaintext_cache_stats():
+    import crypto.crypt
+
+    return crypto.crypt.plaintext_cache.stats()
+
+
+# Process-wide registry rendered by the `/metrics` view.
+registry = Registry()
+
+# Whether the hooks below record anything; set from CHAT_METRICS['ENABLED'] in `ChatConfig.ready`.
+enabled = True
+
+http_request_duration = registry.histogram(
+    'chat_http_request_duration_seconds', 'Time spent handling HTTP requests, by view.', ['view']
+)
+db_queries = registry.counter(
+    'chat_db_queries_total', 'Database queries run while handling HTTP requests, by view.', ['view']
+)
+db_query_duration = registry.counter(
+    'chat_db_query_duration_seconds_total', 'Time spent in database queries while handling HTTP requests, by view.',
+    ['view']
+)
+crypto_duration = registry.histogram(
+    'chat_crypto_duration_seconds', 'Time spent in crypto.crypt encrypt and decrypt calls.', ['operation']
+)
+websocket_connections = registry.gauge(
+    'chat_websocket_connections', 'Open chat WebSocket connections in this process.'
+)
+group_send_duration = registry.histogram(
+    'chat_group_send_duration_seconds', 'Time spent in channel layer group_send calls.'
+)
+fanout_latency = registry.histogram(
+    'chat_fanout_latency_seconds', 'Time from group_send to the message reaching a member consumer.'
+)
+messages_persisted = registry.counter(
+    'chat_messages_persisted_total', 'Chat messages written to the database by the write-behind queue.'
+)
+registry.gauge(
+    'chat_channel_layer_queue_depth', 'Messages waiting in channel layer queues.',
+    collect=_collect_channel_layer('queue_depth')
+)
+registry.gauge(
+    'chat_channel_layer_groups', 'Groups in the channel layer.',
+    collect=_collect_channel_layer('groups')
+)
+registry.gauge(
+    'chat_channel_layer_group_members', 'Channels in channel layer groups, over all groups.',
+    collect=_collect_channel_layer('group_members')
+)
+registry.gauge(
+    'chat_channel_layer_largest_group', 'Channels in the largest channel layer group.',
+    collect=_collect_channel_layer('largest_group')
+)
+
+crypto_executor_wait = registry.histogram(
+    'chat_crypto_executor_wait_seconds', 'Time crypto executor jobs waited in the queue before starting.'
+)
+registry.gauge(
+    'chat_crypto_executor_pending', 'Crypto executor jobs queued or running.',
+    collect=_collect_stats(_crypto_executor_stats, 'pending')
+)
+registry.counter(
+    'chat_crypto_executor_submitted_total', 'Jobs accepted by the crypto executor.',
+    collect=_collect_stats(_crypto_executor_stats, 'submitted')
+)
+registry.counter(
+    'chat_crypto_executor_rejected_total', 'Jobs rejected because the crypto executor was saturated.',
+    collect=_collect_stats(_crypto_executor_stats, 'rejected')
+)
+registry.counter(
+    'chat_crypto_executor_completed_total', 'Jobs finished by the crypto executor.',
+    collect=_collect_stats(_crypto_executor_stats, 'completed')
+)
+registry.counter(
+    'chat_plaintext_cache_hits_total', 'Decryptions answered from the plaintext cache.',
+    collect=_collect_stats(_plaintext_cache_stats, 'hits')
+)
+registry.counter(
+    'chat_plaintext_cache_misses_total', 'Decryptions not found in the plaintext cache.',
+    collect=_collect_stats(_plaintext_cache_stats, 'misses')
+)
+registry.counter(
+    'chat_plaintext_cache_evictions_total', 'Entries evicted from the plaintext cache.',
+    collect=_collect_stats(_plaintext_cache_stats, 'evictions')
+)
+registry.gauge(
+    'chat_plaintext_cache_entries', 'Plaintexts held in the plaintext cache.',
+    collect=_collect_stats(_plaintext_cache_stats, 'entries')
+)
+registry.gauge(
+    'chat_plaintext_cache_bytes', 'Bytes of plaintext held in the plaintext cache.',
+    collect=_collect_stats(_plaintext_cache_stats, 'bytes')
+)
+
+
+def observe_crypto(operation, seconds):
+    """
+    Records one `crypto.crypt` call; installed as `crypto.crypt.observer`.
+    """
+    crypto_duration.observe(seconds, operation=operation)
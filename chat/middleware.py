@@ -0,0 +1,130 @@
+# middleware.py
+import time
+from contextlib import ExitStack
+
+from django.db import connections
+
+from . import metrics, profiling, querylog
+from .utils import get_user_from_session
+
+
+class ChatUserMiddleware:
+    """
+    Resolves the session token to a `User` once per request.
+
+    The user is exposed as `request.chat_user` (None for anonymous requests), so views no
+    longer query `User` by token themselves. Must come after `SessionMiddleware`.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.chat_user = get_user_from_session(request)
+        return self.get_response(request)
+
+
+class QueryTimer:
+    """
+    Database execute wrapper that counts queries and adds up their duration.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
+
+
+class MetricsMiddleware:
+    """
+    Records the latency, query count and query time of every request in `chat.metrics`,
+    labelled with the name of the view that handled it.
+
+    Should come first in MIDDLEWARE so the time spent in other middleware is included.
+    Does nothing when CHAT_METRICS['ENABLED'] is off.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not metrics.enabled:
+            return self.get_response(request)
+
+        queries = QueryTimer()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(queries))
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unmatched'
+        metrics.http_request_duration.observe(elapsed, view=view)
+        metrics.db_queries.inc(queries.count, view=view)
+        metrics.db_query_duration.inc(queries.duration, view=view)
+        return response
+
+
+class QueryProfilerMiddleware:
+    """
+    Records every SQL query run while a request is handled and publishes a report grouped
+    by normalized SQL, flagging statements repeated often enough to look like N+1 queries.
+
+    Reports go to the log and to the ring buffer shown by the `query_reports` view (see
+    `chat.querylog`). Opt-in through CHAT_QUERY_PROFILER['ENABLED']; when off, requests
+    pass straight through.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not querylog.enabled:
+            return self.get_response(request)
+
+        with querylog.record_queries(f'{request.method} {request.path}') as recorder:
+            response = self.get_response(request)
+            match = getattr(request, 'resolver_match', None)
+            if match:
+                recorder.label += f' ({match.view_name})'
+        return response
+
+
+class ProfilerMiddleware:
+    """
+    Samples the stack of the thread running the view for profiled requests and writes
+    collapsed stacks for flamegraphs (see `chat.profiling`).
+
+    Under ASGI the decision is made by `ASGIProfilerMiddleware`, and this middleware only
+    marks the view's thread for its session; otherwise it samples requests itself. The
+    header named by CHAT_PROFILER['HEADER'] carrying CHAT_PROFILER['TOKEN'] forces a capture.
+    When CHAT_PROFILER['ENABLED'] is off, requests pass straight through.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not profiling.enabled:
+            return self.get_response(request)
+
+        session = profiling.current_session()
+        if session is not None:
+            return profiling.run_sync(session, self.get_response, request)
+        if profiling.decided() or not profiling.should_profile(request.headers.get(profiling.header)):
+            return self.get_response(request)
+
+        session, context_token = profiling.start(f'http {request.method} {request.path}')
+        try:
+            return profiling.run_sync(session, self.get_response, request)
+        finally:
+            profiling.stop(session, context_token)
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_alter_chatroom_encryption_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='data_key',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_last_message(apps, schema_editor):
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    Message = apps.get_model('chat', 'Message')
+
+    for room in ChatRoom.objects.all().iterator():
+        last_message = Message.objects.filter(room=room).order_by('-timestamp', '-id').first()
+        if last_message:
+            ChatRoom.objects.filter(id=room.id).update(
+                last_message=last_message,
+                last_message_text=last_message.text,
+                last_message_at=last_message.timestamp
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0009_message_room_timestamp_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chat.message'),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_message_text',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddIndex(
+            model_name='chatroom',
+            index=models.Index(fields=['user1', '-last_message_at'], name='chat_room_user1_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chatroom',
+            index=models.Index(fields=['user2', '-last_message_at'], name='chat_room_user2_recent_idx'),
+        ),
+        migrations.RunPython(backfill_last_message, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:18
+
+import chat.models
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def rotate_duplicate_tokens(apps, schema_editor):
+    # A token shared by several users (e.g. the old '0' default) cannot identify a
+    # session, so every user holding one gets a fresh token before the unique index exists.
+    User = apps.get_model('chat', 'User')
+
+    duplicates = User.objects.values('token').annotate(n=Count('id')).filter(n__gt=1)
+    for user in User.objects.filter(token__in=duplicates.values('token')).iterator():
+        User.objects.filter(id=user.id).update(token=chat.models.random_token())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0010_chatroom_last_message'),
+    ]
+
+    operations = [
+        migrations.RunPython(rotate_duplicate_tokens, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='user',
+            name='token',
+            field=models.TextField(default=chat.models.random_token, max_length=256, unique=True),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:19
+
+from django.db import migrations, models
+
+
+def backfill_user_name_folded(apps, schema_editor):
+    User = apps.get_model('chat', 'User')
+
+    for user in User.objects.all().only('id', 'user_name').iterator():
+        User.objects.filter(id=user.id).update(user_name_folded=user.user_name.casefold())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0011_user_token_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='user_name_folded',
+            field=models.TextField(db_index=True, default='', editable=False, max_length=256),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='user_name',
+            field=models.TextField(db_index=True, default='0', max_length=256),
+        ),
+        migrations.RunPython(backfill_user_name_folded, migrations.RunPython.noop),
+    ]
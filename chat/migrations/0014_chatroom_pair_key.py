@@ -0,0 +1,114 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:41
+
+import re
+
+from django.db import migrations, models
+
+import crypto.crypt
+
+LEGACY_USER_NAME = re.compile(r'^User object \((\d+)\)$')
+
+
+def make_pair_key(user_name1, user_name2):
+    first, second = sorted((user_name1, user_name2))
+    return f'{len(first)}:{first}:{second}'
+
+
+def caesar_shift(text, shift):
+    """
+    Shifts the letters of `text` like the client-side cipher of index.html.
+    """
+    shifted = []
+    for char in text:
+        if 'A' <= char <= 'Z':
+            shifted.append(chr((ord(char) - 65 + shift) % 26 + 65))
+        elif 'a' <= char <= 'z':
+            shifted.append(chr((ord(char) - 97 + shift) % 26 + 97))
+        else:
+            shifted.append(char)
+    return ''.join(shifted)
+
+
+def reseal(text, source, target):
+    """
+    Re-encrypts a message of `source` for `target`: under the target's data key and shift.
+
+    Messages that cannot be decrypted are kept as they are.
+    """
+    if source.data_key == target.data_key and source.encryption_key == target.encryption_key:
+        return text
+    plaintext = crypto.crypt.decrypt(text, source.data_key or None)
+    if plaintext == 'Could not decrypt the message.':
+        return text
+    plaintext = caesar_shift(plaintext, target.encryption_key - source.encryption_key)
+    return crypto.crypt.encrypt(plaintext, target.data_key)
+
+
+def merge_duplicate_rooms(apps, schema_editor):
+    """
+    Sets the pair key of every room and merges rooms sharing a pair into the oldest one.
+
+    `get_or_create_room` used to store `str(user)` rather than the username; such values are
+    replaced with the username first. Messages of a duplicate move to the kept room, re-sealed
+    with its key, and the kept room's last-message fields are recomputed.
+    """
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    Message = apps.get_model('chat', 'Message')
+    User = apps.get_model('chat', 'User')
+
+    def user_name(value):
+        match = LEGACY_USER_NAME.match(value)
+        if match:
+            user = User.objects.filter(id=int(match.group(1))).first()
+            if user is not None:
+                return user.user_name
+        return value
+
+    rooms_by_key = {}
+    for room in ChatRoom.objects.order_by('id').iterator():
+        room.user1 = user_name(room.user1)
+        room.user2 = user_name(room.user2)
+        room.pair_key = make_pair_key(room.user1, room.user2)
+        rooms_by_key.setdefault(room.pair_key, []).append(room)
+
+    for rooms in rooms_by_key.values():
+        kept, duplicates = rooms[0], rooms[1:]
+        if duplicates and not kept.data_key:
+            kept.data_key = crypto.crypt.generate_data_key()
+        for duplicate in duplicates:
+            for message in Message.objects.filter(room=duplicate).iterator():
+                message.room = kept
+                message.text = reseal(message.text, duplicate, kept)
+                message.save(update_fields=['room', 'text'])
+            duplicate.delete()
+
+        if duplicates:
+            last_message = Message.objects.filter(room=kept).order_by('-timestamp', '-id').first()
+            if last_message is not None:
+                kept.last_message = last_message
+                kept.last_message_text = last_message.text
+                kept.last_message_at = last_message.timestamp
+        kept.save(update_fields=[
+            'user1', 'user2', 'pair_key', 'data_key', 'last_message', 'last_message_text', 'last_message_at'
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0013_alter_message_timestamp'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='pair_key',
+            field=models.TextField(editable=False, null=True),
+        ),
+        migrations.RunPython(merge_duplicate_rooms, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='chatroom',
+            name='pair_key',
+            field=models.TextField(editable=False, unique=True),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+def backfill_sequences(apps, schema_editor):
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    Message = apps.get_model('chat', 'Message')
+
+    for room in ChatRoom.objects.all().iterator():
+        messages = list(Message.objects.filter(room=room).order_by('timestamp', 'id').only('id'))
+        for sequence, message in enumerate(messages, start=1):
+            message.sequence = sequence
+        Message.objects.bulk_update(messages, ['sequence'], batch_size=1000)
+        ChatRoom.objects.filter(id=room.id).update(last_sequence=len(messages))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0014_chatroom_pair_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_sequence',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='sequence',
+            field=models.PositiveBigIntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_sequences, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='message',
+            constraint=models.UniqueConstraint(fields=('room', 'sequence'), name='chat_message_room_sequence_uniq'),
+        ),
+    ]
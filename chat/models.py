@@ -2,9 +2,22 @@ from django.db import models
 
 
 from django.db import models
+from django.db.models import F
+from django.utils import timezone
+import random
 import string
 import secrets
 
+import crypto.crypt
+
+
+def random_token():
+    """
+    Returns a 32-character string of random ASCII letters and digits.
+    """
+    alphabet = string.ascii_letters + string.digits
+    return ''.join(secrets.choice(alphabet) for _ in range(32))
+
 
 class User(models.Model):
     """
@@ -14,19 +27,27 @@ class User(models.Model):
         UID (TextField): Unique identifier for the user.
         name (TextField): The real name of the user.
         user_name (TextField): The username of the user.
+        user_name_folded (TextField): The case-folded username, indexed for prefix search.
         email (TextField): The email address of the user.
         password (TextField): The password of the user (preferably hashed).
-        token (TextField): Authentication token for the user.
+        token (TextField): Authentication token for the user. Unique, so session lookups use an index.
 
     Methods:
         generate_token: Generates a new authentication token for the user and saves it.
     """
     UID = models.TextField(max_length=256, default='0')
     name = models.TextField(max_length=256, default='0')
-    user_name = models.TextField(max_length=256, default='0')
+    user_name = models.TextField(max_length=256, default='0', db_index=True)
+    user_name_folded = models.TextField(max_length=256, default='', db_index=True, editable=False)
     email = models.TextField(max_length=256, default='0')
     password = models.TextField(max_length=256, default='0')
-    token = models.TextField(max_length=256, default='0')
+    token = models.TextField(max_length=256, default=random_token, unique=True)
+
+    def save(self, *args, **kwargs):
+        self.user_name_folded = self.user_name.casefold()
+        if kwargs.get('update_fields') is not None and 'user_name' in kwargs['update_fields']:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'user_name_folded'}
+        super().save(*args, **kwargs)
 
     def generate_token(self):
         """
@@ -35,8 +56,7 @@ class User(models.Model):
         The token is a 32-character string consisting of random ASCII letters and digits.
         The new token is saved to the database.
         """
-        alphabet = string.ascii_letters + string.digits
-        self.token = ''.join(secrets.choice(alphabet) for _ in range(32))
+        self.token = random_token()
         self.save()
 
 
@@ -47,13 +67,168 @@ class ChatRoom(models.Model):
     Attributes:
         user1 (TextField): The username of the first participant.
         user2 (TextField): The username of the second participant.
+        pair_key (TextField): The participants in canonical order, see `make_pair_key`. Unique, so a pair
+                              of users has at most one room and finding it is a single index probe.
+        encryption_key (IntegerField): The shift used by the client-side cipher.
+        data_key (TextField): The RSA-wrapped symmetric key that seals the room's messages at rest.
+        last_message (ForeignKey): The most recent message in the room, if any.
+        last_message_text (TextField): The ciphertext of the most recent message, for inbox previews.
+        last_message_at (DateTimeField): The timestamp of the most recent message.
+        last_sequence (PositiveBigIntegerField): The sequence number given to the room's latest message, 0 if none.
         created_at (DateTimeField): The timestamp when the chat room was created. Automatically set when the room is created.
+
+    Methods:
+        make_pair_key: Returns the canonical key of a pair of usernames.
+        get_or_create_between: Returns the room of two users, creating it if needed.
+        get_data_key: Returns the room's wrapped data key, creating it on first use.
+        allocate_sequences: Reserves consecutive sequence numbers for new messages of a room.
+        messages_since: Returns the messages saved after a given sequence number.
+        latest_messages: Returns the most recent messages.
     """
     user1 = models.TextField(default='0')
     user2 = models.TextField(default='0')
+    pair_key = models.TextField(unique=True, editable=False)
     encryption_key = models.IntegerField(default=0)
+    data_key = models.TextField(default='', blank=True)
+    last_message = models.ForeignKey('Message', null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    last_message_text = models.TextField(default='', blank=True)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    last_sequence = models.PositiveBigIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Serve the inbox query: rooms of a participant ordered by recency.
+            models.Index(fields=['user1', '-last_message_at'], name='chat_room_user1_recent_idx'),
+            models.Index(fields=['user2', '-last_message_at'], name='chat_room_user2_recent_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.pair_key = self.make_pair_key(self.user1, self.user2)
+        if kwargs.get('update_fields') is not None and {'user1', 'user2'} & set(kwargs['update_fields']):
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'pair_key'}
+        super().save(*args, **kwargs)
+
+    @staticmethod
+    def make_pair_key(user_name1, user_name2):
+        """
+        Returns the canonical key of a pair of usernames, the same whichever order they are given in.
+
+        The length of the name that sorts first prefixes the key, so no pair of names can produce
+        the key of another.
+        """
+        first, second = sorted((user_name1, user_name2))
+        return f'{len(first)}:{first}:{second}'
+
+    @classmethod
+    def get_or_create_between(cls, user_name1, user_name2):
+        """
+        Returns the chat room between two users, creating it if it does not exist.
+
+        The room is found by its unique `pair_key`. When concurrent requests both miss it, the
+        unique index rejects the second insert and `get_or_create` returns the first room, so a
+        pair never ends up with two rooms. The shift and data key of a new room are only
+        generated when the room is actually created.
+
+        Args:
+            user_name1 (str): The username of one participant.
+            user_name2 (str): The username of the other participant.
+
+        Returns:
+            tuple: The `ChatRoom` and whether it was created.
+        """
+        return cls.objects.get_or_create(
+            pair_key=cls.make_pair_key(user_name1, user_name2),
+            defaults={
+                'user1': user_name1,
+                'user2': user_name2,
+                'encryption_key': lambda: random.randint(1, 25),
+                'data_key': crypto.crypt.generate_data_key,
+            }
+        )
+
+    def get_data_key(self):
+        """
+        Returns the RSA-wrapped data key of the room, generating one if the room has none yet.
+
+        Rooms created before envelope encryption have no data key. The key is stored with a
+        conditional update so concurrent writers agree on a single key for the room.
+
+        Returns:
+            str: The Base64-encoded, RSA-wrapped data key.
+        """
+        if not self.data_key:
+            data_key = crypto.crypt.generate_data_key()
+            if ChatRoom.objects.filter(id=self.id, data_key='').update(data_key=data_key):
+                self.data_key = data_key
+            else:
+                self.refresh_from_db(fields=['data_key'])
+        return self.data_key
+
+    @staticmethod
+    def allocate_sequences(room_id, count=1):
+        """
+        Reserves `count` consecutive sequence numbers for new messages of a room.
+
+        The room's counter is incremented before it is read, so the row stays locked until the
+        caller's transaction ends and concurrent writers get disjoint ranges. Must be called in
+        the transaction that saves the messages.
+
+        Args:
+            room_id (int): The ID of the chat room.
+            count (int): The number of messages to number.
+
+        Returns:
+            int: The first reserved sequence number.
+        """
+        ChatRoom.objects.filter(id=room_id).update(last_sequence=F('last_sequence') + count)
+        last_sequence = ChatRoom.objects.filter(id=room_id).values_list('last_sequence', flat=True).get()
+        return last_sequence - count + 1
+
+    def messages_since(self, sequence, limit):
+        """
+        Returns the messages of the room saved after the one numbered `sequence`.
+
+        A single range scan of the `(room, sequence)` unique index.
+
+        Args:
+            sequence (int): The last sequence number the caller has; 0 for the whole history.
+            limit (int): Maximum number of messages to return.
+
+        Returns:
+            tuple: The list of message dicts (`id`, `sequence`, `text`, `timestamp`,
+            `sender__user_name`) in sequence order, and whether more messages follow them.
+        """
+        page = list(
+            Message.objects.filter(room=self, sequence__gt=sequence).order_by('sequence').values(
+                'id', 'sequence', 'text', 'timestamp', 'sender__user_name'
+            )[:limit + 1]
+        )
+        return page[:limit], len(page) > limit
+
+    def latest_messages(self, limit):
+        """
+        Returns the `limit` most recent messages of the room.
+
+        A single backward scan of the `(room, sequence)` unique index.
+
+        Args:
+            limit (int): Maximum number of messages to return.
+
+        Returns:
+            tuple: The list of message dicts, shaped as in `messages_since`, in sequence order,
+            and whether older messages exist.
+        """
+        page = list(
+            Message.objects.filter(room=self).order_by('-sequence').values(
+                'id', 'sequence', 'text', 'timestamp', 'sender__user_name'
+            )[:limit + 1]
+        )
+        has_more = len(page) > limit
+        page = page[:limit]
+        page.reverse()
+        return page, has_more
+
 
 class Message(models.Model):
     """
@@ -65,9 +240,23 @@ class Message(models.Model):
         sender (ForeignKey): The user who sent the message.
                              Links to the `User` model.
         text (TextField): The content of the message.
-        timestamp (DateTimeField): The time when the message was created. Automatically set when the message is created.
+        sequence (PositiveBigIntegerField): The position of the message in its room, counting from 1 without
+                                            gaps. Clients pass the last one they have to fetch only newer messages.
+        timestamp (DateTimeField): The time when the message was created. Defaults to now; the write-behind
+                                   queue sets it to the time the message was received and broadcast.
     """
     room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE)
     sender = models.ForeignKey(User, on_delete=models.CASCADE)
     text = models.TextField(default='0')
-    timestamp = models.DateTimeField(auto_now_add=True)
+    sequence = models.PositiveBigIntegerField()
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Serves keyset pagination of a room's history in (timestamp, id) order.
+            models.Index(fields=['room', 'timestamp', 'id'], name='chat_message_room_ts_id_idx'),
+        ]
+        constraints = [
+            # Also serves delta sync: the messages of a room after a given sequence.
+            models.UniqueConstraint(fields=['room', 'sequence'], name='chat_message_room_sequence_uniq'),
+        ]
@@ -0,0 +1,222 @@
+# persistence.py
+import asyncio
+import atexit
+import itertools
+import logging
+import threading
+from collections import Counter, namedtuple
+
+from channels.db import database_sync_to_async
+from django.db import transaction
+
+from . import metrics
+from .models import ChatRoom, Message
+
+# A message accepted by a consumer and waiting to be written. `room` and `sender` are the
+# `ChatRoom` and `User` the consumer resolved when the connection was opened, and `text`
+# is the message already encrypted with the room's data key.
+PendingMessage = namedtuple('PendingMessage', ['room', 'sender', 'text', 'timestamp'])
+
+
+def write_messages(pending):
+    """
+    Saves a batch of pending messages with one `bulk_create`.
+
+    Each room reserves sequence numbers for its messages in the batch, and its last-message
+    fields are updated, in the same transaction as the insert.
+
+    Args:
+        pending (list): The `PendingMessage` tuples to save, in order.
+
+    Returns:
+        list: The saved `Message` for each pending message.
+    """
+    messages = [
+        Message(
+            room=p.room,
+            sender=p.sender,
+            text=p.text,
+            timestamp=p.timestamp
+        )
+        for p in pending
+    ]
+
+    with transaction.atomic():
+        counts = Counter(message.room_id for message in messages)
+        next_sequence = {room_id: ChatRoom.allocate_sequences(room_id, count) for room_id, count in counts.items()}
+        for message in messages:
+            message.sequence = next_sequence[message.room_id]
+            next_sequence[message.room_id] += 1
+
+        Message.objects.bulk_create(messages)
+
+        latest = {message.room_id: message for message in messages}
+        for room_id, message in latest.items():
+            ChatRoom.objects.filter(id=room_id).update(
+                last_message=message,
+                last_message_text=message.text,
+                last_message_at=message.timestamp
+            )
+
+    return messages
+
+
+class MessageWriter:
+    """
+    Write-behind queue that persists chat messages in batches.
+
+    Consumers broadcast a message first and then `submit` it here. Pending messages are
+    written with `write_messages` once `batch_size` of them are queued or `flush_interval`
+    seconds have passed, whichever comes first. Each submission returns a future that
+    resolves to the saved `Message` once the batch is committed, so the consumer can
+    acknowledge durability to the sender.
+
+    Whatever is still pending is flushed when a consumer disconnects (`flush`) and,
+    synchronously, when the process exits. Batches already taken by `flush` are tracked
+    until a worker thread starts writing them: at exit, writes in progress are waited for
+    (up to `exit_timeout` seconds) and batches no thread has started are written too.
+
+    Attributes:
+        flush_interval (float): Maximum number of seconds a message waits before being written.
+        batch_size (int): Number of pending messages that triggers an immediate write.
+        exit_timeout (float): Maximum number of seconds the exit hook waits for writes in progress.
+    """
+
+    def __init__(self, flush_interval=0.05, batch_size=100, exit_timeout=10):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.exit_timeout = exit_timeout
+        self._pending = []
+        # Batches taken by `flush` that no thread has started writing, by batch number.
+        self._in_flight = {}
+        self._batch_numbers = itertools.count()
+        self._writing = 0
+        self._in_flight_changed = threading.Condition()
+        self._batch_full = None
+        self._task = None
+        atexit.register(self._flush_on_exit)
+
+    def submit(self, room, sender, text, timestamp):
+        """
+        Queues a message for writing.
+
+        Args:
+            room (ChatRoom): The chat room the message was sent to.
+            sender (User): The user who sent the message.
+            text (str): The message, encrypted with the room's data key.
+            timestamp (datetime): The time the message was accepted, stored on the row.
+
+        Returns:
+            asyncio.Future: Resolves to the saved `Message` once the write is committed, or
+            to None if the write failed even when retried (see `_write_batch`).
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((PendingMessage(room, sender, text, timestamp), future))
+
+        if self._task is None or self._task.get_loop() is not loop:
+            self._batch_full = asyncio.Event()
+            self._task = loop.create_task(self._run())
+        if len(self._pending) >= self.batch_size:
+            self._batch_full.set()
+
+        return future
+
+    async def flush(self):
+        """
+        Writes every pending message now, in batches of at most `batch_size`.
+        """
+        while self._pending:
+            batch, self._pending = self._pending[:self.batch_size], self._pending[self.batch_size:]
+            number = next(self._batch_numbers)
+            with self._in_flight_changed:
+                self._in_flight[number] = [p for p, _ in batch]
+            saved = await database_sync_to_async(self._write_in_flight)(number) or [None] * len(batch)
+
+            if metrics.enabled:
+                metrics.messages_persisted.inc(sum(message is not None for message in saved))
+
+            for (_, future), message in zip(batch, saved):
+                if not future.done():
+                    future.set_result(message)
+
+    def _write_in_flight(self, number):
+        """
+        Writes the in-flight batch `number` unless the exit hook already took it.
+
+        Returns:
+            list: The result of `_write_batch`, or None if the batch was taken.
+        """
+        with self._in_flight_changed:
+            pending = self._in_flight.pop(number, None)
+            if pending is None:
+                return None
+            self._writing += 1
+        try:
+            return self._write_batch(pending)
+        finally:
+            with self._in_flight_changed:
+                self._writing -= 1
+                self._in_flight_changed.notify_all()
+
+    @staticmethod
+    def _write_batch(pending):
+        """
+        Writes a batch, retrying it once and then room by room if it keeps failing.
+
+        The messages were already broadcast, so a transient error (e.g. a locked database)
+        must not drop the batch, and a room whose write fails must not drop the others.
+
+        Returns:
+            list: The saved `Message` for each pending message, None for those not saved.
+        """
+        for attempt in range(2):
+            try:
+                return write_messages(pending)
+            except Exception:
+                logging.exception('Error writing %d chat messages (attempt %d)', len(pending), attempt + 1)
+
+        rooms = {}
+        for index, p in enumerate(pending):
+            rooms.setdefault(p.room.id, []).append(index)
+        if len(rooms) == 1:
+            return [None] * len(pending)
+
+        saved = [None] * len(pending)
+        for room_id, indexes in rooms.items():
+            try:
+                messages = write_messages([pending[i] for i in indexes])
+            except Exception:
+                logging.exception('Error writing %d chat messages of room %s', len(indexes), room_id)
+                continue
+            for index, message in zip(indexes, messages):
+                saved[index] = message
+        return saved
+
+    async def _run(self):
+        try:
+            while self._pending:
+                try:
+                    await asyncio.wait_for(self._batch_full.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._batch_full.clear()
+                await self.flush()
+        finally:
+            self._task = None
+
+    def _flush_on_exit(self):
+        with self._in_flight_changed:
+            if not self._in_flight_changed.wait_for(lambda: not self._writing, self.exit_timeout):
+                logging.error('Chat message writes still in progress at exit')
+            batches = list(self._in_flight.values())
+            self._in_flight.clear()
+
+        pending, self._pending = self._pending, []
+        batches.append([p for p, _ in pending])
+        for batch in batches:
+            if batch:
+                self._write_batch(batch)
+
+
+message_writer = MessageWriter()
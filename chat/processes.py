@@ -0,0 +1,66 @@
+# processes.py
+"""
+Entry points of the processes spawned by the cross-process tests in `chat.tests`.
+
+They live outside `chat.tests` because a spawned process imports the module of its target
+before Django is set up, and `chat.tests` imports the models.
+"""
+import asyncio
+import os
+from types import SimpleNamespace
+
+from .layers import SQLiteChannelLayer
+
+
+def run_group_member(path, group, ready, results):
+    """
+    Joins `group` through its own SQLiteChannelLayer and reports the first message it receives.
+
+    Runs in a separate process, standing in for a consumer held by another worker.
+    """
+    async def main():
+        layer = SQLiteChannelLayer(path)
+        channel = await layer.new_channel()
+        await layer.group_add(group, channel)
+        ready.set()
+        message = await asyncio.wait_for(layer.receive(channel), 10)
+        results.put((os.getpid(), message['text']))
+        await layer.close()
+
+    asyncio.run(main())
+
+
+def run_chat_member(path, room_id, ready, results):
+    """
+    Connects a `ChatConsumer` to room `room_id` over its own SQLiteChannelLayer and reports
+    the first frame it receives.
+
+    Runs in a separate process, like a client connected to another worker. The user and room
+    are stubbed, so no database is needed.
+    """
+    import django
+    django.setup()
+
+    from channels.layers import channel_layers
+    from channels.routing import URLRouter
+    from channels.testing import WebsocketCommunicator
+    from django.urls import re_path
+    from .consumers import ChatConsumer
+
+    class StubbedChatConsumer(ChatConsumer):
+        async def get_user_and_room(self, room_name):
+            user = SimpleNamespace(user_name=f'member{os.getpid()}')
+            return user, SimpleNamespace(id=int(room_name), encryption_key=3, data_key='')
+
+    async def main():
+        channel_layers.set('default', SQLiteChannelLayer(path))
+        application = URLRouter([re_path(r'^ws/chat/(?P<room_name>\w+)/$', StubbedChatConsumer.as_asgi())])
+        communicator = WebsocketCommunicator(application, f'/ws/chat/{room_id}/')
+        connected, _ = await communicator.connect()
+        ready.set()
+        if connected:
+            frame = await communicator.receive_json_from(timeout=10)
+            results.put((os.getpid(), frame['message']))
+        await communicator.disconnect()
+
+    asyncio.run(main())
@@ -0,0 +1,300 @@
+# profiling.py
+import functools
+import hmac
+import itertools
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime
+
+# Settings, set from CHAT_PROFILER in `ChatConfig.ready`. While `enabled` is off every hook
+# below costs one flag check.
+enabled = False
+sample_rate = 0.0
+interval = 0.001
+output_dir = 'profiles'
+header = 'X-Chat-Profile'
+token = None
+
+_session = ContextVar('chat_profile_session', default=None)
+_decided = ContextVar('chat_profile_decided', default=False)
+_forced = 0
+_forced_lock = threading.Lock()
+_sequence = itertools.count(1)
+
+# Session of every running `run_sync` / `run_async` call, keyed by the id of its frame.
+_marked = {}
+
+
+class ProfileSession:
+    """
+    The stack samples collected while one HTTP request or WebSocket frame is handled.
+
+    Attributes:
+        label (str): What is being profiled, e.g. 'http GET /get_user_chat_rooms'.
+        stacks (Counter): Number of samples per stack, each a tuple of frame names, outermost first.
+    """
+
+    def __init__(self, label):
+        self.label = label
+        self.stacks = Counter()
+        self.started_at = datetime.now()
+        self.active = True
+
+    def collapsed(self):
+        """
+        Returns the samples in the collapsed-stack format read by flamegraph.pl and speedscope.
+        """
+        root = self.label.split(' ', 1)[0]
+        return ''.join(
+            f"{';'.join((root,) + stack)} {count}\n" for stack, count in self.stacks.most_common()
+        )
+
+    def finish(self):
+        """
+        Stops sampling and writes the collapsed stacks to `output_dir`.
+
+        Returns:
+            str: The path of the written file, or None if no sample was taken.
+        """
+        self.active = False
+        _sampler.release()
+        if not self.stacks:
+            return None
+
+        os.makedirs(output_dir, exist_ok=True)
+        slug = re.sub(r'[^A-Za-z0-9]+', '-', self.label).strip('-')[:80]
+        path = os.path.join(
+            output_dir, f'{self.started_at:%Y%m%dT%H%M%S}-{next(_sequence):06d}-{slug}.folded'
+        )
+        with open(path, 'w') as f:
+            f.write(self.collapsed())
+        return path
+
+
+def run_sync(session, func, *args):
+    """
+    Calls `func(*args)`; samples of the calling thread taken meanwhile belong to `session`.
+    """
+    frame_id = id(sys._getframe())
+    _marked[frame_id] = session
+    try:
+        return func(*args)
+    finally:
+        del _marked[frame_id]
+
+
+async def run_async(session, func, *args):
+    """
+    Awaits `func(*args)`; samples of the event loop thread taken while the coroutine is
+    running (not while it is suspended) belong to `session`.
+    """
+    frame_id = id(sys._getframe())
+    _marked[frame_id] = session
+    try:
+        return await func(*args)
+    finally:
+        del _marked[frame_id]
+
+
+_MARKERS = {run_sync.__code__, run_async.__code__}
+
+
+class _Sampler:
+    """
+    Background thread that samples the stack of every thread while sessions are active.
+
+    A thread's sample belongs to the session found in its innermost `run_sync` /
+    `run_async` frame; only the frames above the marker are kept. Threads without a
+    marker, e.g. the event loop while it runs another connection's task, are skipped.
+    The thread only runs while at least one session is active.
+    """
+
+    def __init__(self):
+        self._active = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def acquire(self):
+        with self._lock:
+            self._active += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='chat-profiler', daemon=True)
+                self._thread.start()
+
+    def release(self):
+        with self._lock:
+            self._active -= 1
+
+    def _run(self):
+        own = threading.get_ident()
+        while True:
+            with self._lock:
+                if not self._active:
+                    self._thread = None
+                    return
+            self.sample(own)
+            time.sleep(interval)
+
+    @staticmethod
+    def sample(own):
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own:
+                continue
+            names = []
+            while frame is not None and frame.f_code not in _MARKERS:
+                names.append(_frame_name(frame))
+                frame = frame.f_back
+            if frame is None:
+                continue
+            session = _marked.get(id(frame))
+            if session is not None and session.active:
+                session.stacks[tuple(reversed(names))] += 1
+
+
+_sampler = _Sampler()
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{frame.f_globals.get('__name__', '?')}:{code.co_qualname}"
+
+
+def capture(count):
+    """
+    Profiles the next `count` requests and frames regardless of `sample_rate`; 0 stops.
+
+    Applies to this process only.
+    """
+    global _forced
+    with _forced_lock:
+        _forced = max(0, count)
+
+
+def pending_captures():
+    """
+    Returns the number of requests or frames still to be profiled by `capture`.
+    """
+    return _forced
+
+
+def should_profile(header_value=None):
+    """
+    Decides whether to profile a request or frame.
+
+    Profiles when the header carries `token`, when `capture` asked for more captures, or
+    otherwise for a random `sample_rate` fraction.
+    """
+    global _forced
+    if header_value is not None and token and hmac.compare_digest(header_value, token):
+        return True
+    if _forced:
+        with _forced_lock:
+            if _forced:
+                _forced -= 1
+                return True
+    return sample_rate > 0 and random.random() < sample_rate
+
+
+def start(label):
+    """
+    Starts a session and makes it current for the calling context.
+
+    Returns:
+        tuple: The `ProfileSession` and the context variable token to pass to `stop`.
+    """
+    session = ProfileSession(label)
+    _sampler.acquire()
+    return session, _session.set(session)
+
+
+def stop(session, context_token):
+    _session.reset(context_token)
+    return session.finish()
+
+
+def current_session():
+    """
+    Returns the session of the request being handled, e.g. one started by `ASGIProfilerMiddleware`.
+    """
+    return _session.get()
+
+
+def decided():
+    """
+    Returns whether `ASGIProfilerMiddleware` already decided whether to profile this request.
+    """
+    return _decided.get()
+
+
+def _scope_header(scope):
+    name = header.lower().encode()
+    for key, value in scope.get('headers', ()):
+        if key == name:
+            return value.decode('latin-1')
+    return None
+
+
+class ASGIProfilerMiddleware:
+    """
+    ASGI middleware profiling the HTTP app for sampled requests.
+
+    Covers the async side of Django's ASGI handler on the event loop thread. The session
+    is also made current for the request's context, so `ProfilerMiddleware` samples the
+    thread running the synchronous middleware and view under the same session.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not enabled or scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        decided_token = _decided.set(True)
+        try:
+            if not should_profile(_scope_header(scope)):
+                return await self.app(scope, receive, send)
+
+            session, context_token = start(f"http {scope['method']} {scope['path']}")
+            try:
+                return await run_async(session, self.app, scope, receive, send)
+            finally:
+                stop(session, context_token)
+        finally:
+            _decided.reset(decided_token)
+
+
+def profile_consumer_frames(handler):
+    """
+    Decorates a consumer handler so sampled calls are profiled.
+
+    A connection whose handshake carried the profiling header with the right token is
+    profiled on every call. Work the handler hands to other threads or processes (e.g.
+    `database_sync_to_async` or the crypto executor) is not sampled.
+    """
+    @functools.wraps(handler)
+    async def wrapper(self, *args, **kwargs):
+        if not enabled or not should_profile(_scope_header(self.scope)):
+            return await handler(self, *args, **kwargs)
+
+        session, context_token = start(f"ws {type(self).__name__}.{handler.__name__} {self.scope.get('path', '')}")
+        try:
+            return await run_async(session, functools.partial(handler, self, *args, **kwargs))
+        finally:
+            stop(session, context_token)
+    return wrapper
+
+
+def list_profiles():
+    """
+    Returns the names of the collapsed-stack files in `output_dir`, newest first.
+    """
+    if not os.path.isdir(output_dir):
+        return []
+    return sorted((name for name in os.listdir(output_dir) if name.endswith('.folded')), reverse=True)
@@ -0,0 +1,206 @@
+# querylog.py
+import functools
+import logging
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+logger = logging.getLogger('chat.queries')
+
+# Whether queries are recorded; set from CHAT_QUERY_PROFILER in `ChatConfig.ready`.
+enabled = False
+
+# Number of runs of one normalized statement within a request or frame that flags it as an N+1 pattern.
+repeat_threshold = 3
+
+# Whether every report is also written to the `chat.queries` logger.
+log_reports = True
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?\b')
+_PLACEHOLDER = re.compile(r'%s|\?')
+_VALUE_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_SPACE = re.compile(r'\s+')
+
+_current = ContextVar('chat_query_recorder', default=None)
+
+
+def normalize_sql(sql):
+    """
+    Reduces a SQL statement to its shape, so runs with different parameters group together.
+
+    String and numeric literals and placeholders become `?`, lists of values (as in
+    `IN (...)` or multi-row `VALUES`) collapse to `(...)`, and whitespace is collapsed.
+    """
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _PLACEHOLDER.sub('?', sql)
+    sql = _VALUE_LIST.sub('(...)', sql)
+    return _SPACE.sub(' ', sql).strip()
+
+
+class QueryRecorder:
+    """
+    Collects the queries run while one HTTP request or WebSocket frame is handled.
+
+    Attributes:
+        label (str): What was handled, e.g. 'GET /get_user_chat_rooms'.
+        queries (list): `(sql, seconds)` for every query, in order.
+    """
+
+    def __init__(self, label):
+        self.label = label
+        self.queries = []
+        self.closed = False
+        self.started_at = datetime.now(timezone.utc)
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, sql, seconds):
+        with self._lock:
+            if not self.closed:
+                self.queries.append((sql, seconds))
+
+    def close(self):
+        """
+        Stops recording and returns the report.
+
+        Returns:
+            dict: The label, start time, handling time, query count and total query time,
+            the queries grouped by normalized SQL (most frequent first) with their count and
+            time, and the normalized statements run at least `repeat_threshold` times.
+        """
+        with self._lock:
+            self.closed = True
+            queries = list(self.queries)
+
+        groups = {}
+        for sql, seconds in queries:
+            group = groups.setdefault(normalize_sql(sql), {'count': 0, 'time': 0.0, 'example': sql})
+            group['count'] += 1
+            group['time'] += seconds
+
+        ordered = sorted(groups.items(), key=lambda item: (-item[1]['count'], -item[1]['time']))
+        return {
+            'label': self.label,
+            'started_at': self.started_at.isoformat(),
+            'duration': time.perf_counter() - self._started,
+            'queries': len(queries),
+            'query_time': sum(seconds for _, seconds in queries),
+            'groups': [{'sql': sql, **group} for sql, group in ordered],
+            'repeated': [sql for sql, group in ordered if group['count'] >= repeat_threshold],
+        }
+
+
+class ReportBuffer:
+    """
+    Thread-safe ring buffer holding the most recent query reports.
+    """
+
+    def __init__(self, size=100):
+        self._reports = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def resize(self, size):
+        with self._lock:
+            self._reports = deque(self._reports, maxlen=size)
+
+    def add(self, report):
+        with self._lock:
+            self._reports.append(report)
+
+    def list(self):
+        """
+        Returns the buffered reports, newest first.
+        """
+        with self._lock:
+            return list(reversed(self._reports))
+
+    def clear(self):
+        with self._lock:
+            self._reports.clear()
+
+
+reports = ReportBuffer()
+
+
+def execute_wrapper(execute, sql, params, many, context):
+    """
+    Database execute wrapper feeding the recorder of the current request or frame.
+
+    Installed on every connection by `install`. The recorder is found through a context
+    variable, which `sync_to_async` carries into worker threads, so queries run from
+    `database_sync_to_async` are attributed to the frame that awaited them.
+    """
+    recorder = _current.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        recorder.add(sql, time.perf_counter() - started)
+
+
+def install(connection, **kwargs):
+    """
+    Adds `execute_wrapper` to a database connection; connected to `connection_created`.
+    """
+    if execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, execute_wrapper)
+
+
+@contextmanager
+def record_queries(label):
+    """
+    Records the queries run inside the `with` block and publishes the report at its end.
+
+    The report goes to the `reports` buffer and, if `log_reports` is set, to the log: as a
+    warning when a statement repeats `repeat_threshold` times or more, otherwise at debug level.
+
+    Yields:
+        QueryRecorder: The recorder, whose `label` may still be refined.
+    """
+    recorder = QueryRecorder(label)
+    token = _current.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _current.reset(token)
+        publish(recorder.close())
+
+
+def publish(report):
+    reports.add(report)
+    if not log_reports:
+        return
+    if report['repeated']:
+        logger.warning(
+            '%s ran %d queries in %.1f ms; repeated: %s',
+            report['label'], report['queries'], report['query_time'] * 1000,
+            '; '.join(f"{group['count']}x {group['sql']}" for group in report['groups']
+                      if group['sql'] in report['repeated'])
+        )
+    else:
+        logger.debug('%s ran %d queries in %.1f ms', report['label'], report['queries'], report['query_time'] * 1000)
+
+
+def record_consumer_queries(handler):
+    """
+    Decorates a consumer handler so the queries run while it handles a frame are recorded.
+
+    Does nothing beyond a flag check when the profiler is disabled. Queries issued later by
+    tasks the handler started (e.g. the write-behind queue) are not attributed to the frame.
+    """
+    @functools.wraps(handler)
+    async def wrapper(self, *args, **kwargs):
+        if not enabled:
+            return await handler(self, *args, **kwargs)
+        with record_queries(f"WS {type(self).__name__}.{handler.__name__} {self.scope.get('path', '')}"):
+            return await handler(self, *args, **kwargs)
+    return wrapper
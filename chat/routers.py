@@ -0,0 +1,51 @@
+# routers.py
+import functools
+from contextvars import ContextVar
+
+from django.conf import settings
+
+# Alias of the read-only connection used by views decorated with `read_only`.
+REPLICA_ALIAS = 'replica'
+
+_read_only = ContextVar('chat_read_only', default=False)
+
+
+def read_only(view):
+    """
+    Decorates a view whose reads may go to the read-only connection.
+
+    Writes made while it runs (e.g. saving the session) still go to the default database.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        token = _read_only.set(True)
+        try:
+            return view(*args, **kwargs)
+        finally:
+            _read_only.reset(token)
+    return wrapper
+
+
+class ReadOnlyRouter:
+    """
+    Routes the reads of `read_only` views to the REPLICA_ALIAS connection.
+
+    The replica is the same SQLite file opened read-only; in WAL mode its readers never
+    block, and are never blocked by, the message writer. Without a REPLICA_ALIAS database
+    everything stays on the default connection.
+    """
+
+    def db_for_read(self, model, **hints):
+        if _read_only.get() and REPLICA_ALIAS in settings.DATABASES:
+            return REPLICA_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases are the same database.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != REPLICA_ALIAS
@@ -1,3 +1,635 @@
-from django.test import TestCase
+import asyncio
+import base64
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+
+from datetime import timedelta
+from importlib import import_module
+from unittest import mock
+
+from channels.exceptions import ChannelFull
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.db import IntegrityError, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import re_path
+from django.utils import timezone
+
+import crypto.crypt
+from crypto.backends import BACKENDS, get_backend
+from crypto.cache import PlaintextCache
+from crypto.executor import CryptoExecutor, ExecutorSaturated
+from .consumers import CLOSE_NOT_AUTHENTICATED, CLOSE_ROOM_NOT_FOUND, ChatConsumer
+from .layers import SQLiteChannelLayer
+from .processes import run_chat_member, run_group_member
+from .models import ChatRoom, User
+from .persistence import MessageWriter, PendingMessage, write_messages
+from .utils import token_cache
+
+
+class CryptoBackendParityTests(SimpleTestCase):
+    """
+    Checks that every registered crypto backend reads the same keys and
+    produces ciphertexts the other backends can decrypt.
+    """
+
+    def setUp(self):
+        self.addCleanup(crypto.crypt.configure, crypto.crypt.backend.name)
+
+    def test_ciphertexts_are_interchangeable(self):
+        for producer_name in BACKENDS:
+            for consumer_name in BACKENDS:
+                with self.subTest(producer=producer_name, consumer=consumer_name):
+                    crypto.crypt.configure(producer_name)
+                    ciphertext = crypto.crypt.encrypt('hello')
+                    data_key = crypto.crypt.generate_data_key()
+                    sealed = crypto.crypt.encrypt('x' * 1000, data_key)
+
+                    crypto.crypt.configure(consumer_name)
+                    self.assertEqual(crypto.crypt.decrypt(ciphertext), 'hello')
+                    self.assertEqual(crypto.crypt.decrypt(sealed, data_key), 'x' * 1000)
+
+    def test_generated_keys_load_in_every_backend(self):
+        for producer_name in BACKENDS:
+            producer = get_backend(producer_name)
+            with tempfile.TemporaryDirectory() as keys_dir:
+                crypto.crypt.configure(producer_name)
+                crypto.crypt.generate_keys(keys_dir)
+                pub_key, _ = crypto.crypt.load_keys(keys_dir)
+                ciphertext = producer.encrypt(b'payload', pub_key)
+
+                for consumer_name in BACKENDS:
+                    with self.subTest(producer=producer_name, consumer=consumer_name):
+                        crypto.crypt.configure(consumer_name)
+                        _, priv_key = crypto.crypt.load_keys(keys_dir)
+                        self.assertEqual(crypto.crypt.backend.decrypt(ciphertext, priv_key), b'payload')
+
+    def test_unknown_backend_is_rejected(self):
+        with self.assertRaises(ValueError):
+            crypto.crypt.configure('nope')
+
+
+class EnvelopeEncryptionTests(SimpleTestCase):
+    """
+    Checks messages sealed under a room data key and the fallback for legacy RSA ciphertexts.
+    """
+
+    def setUp(self):
+        crypto.crypt.plaintext_cache.clear()
+        self.addCleanup(crypto.crypt.plaintext_cache.clear)
+
+    def test_round_trip(self):
+        data_key = crypto.crypt.generate_data_key()
+        sealed = crypto.crypt.encrypt('hello ' * 100, data_key)
+
+        self.assertTrue(sealed.startswith(crypto.crypt.ENVELOPE_HEADER))
+        self.assertNotEqual(sealed, crypto.crypt.encrypt('hello ' * 100, data_key))
+        self.assertEqual(crypto.crypt.decrypt(sealed, data_key), 'hello ' * 100)
+
+    def test_wrong_or_missing_data_key_fails(self):
+        sealed = crypto.crypt.encrypt('hello', crypto.crypt.generate_data_key())
+
+        self.assertEqual(crypto.crypt.decrypt(sealed, crypto.crypt.generate_data_key()), 'Could not decrypt the message.')
+        self.assertEqual(crypto.crypt.decrypt(sealed), 'Could not decrypt the message.')
+
+    def test_tampered_envelope_fails(self):
+        data_key = crypto.crypt.generate_data_key()
+        sealed = crypto.crypt.encrypt('hello', data_key)
+        raw = bytearray(base64.b64decode(sealed[len(crypto.crypt.ENVELOPE_HEADER):]))
+        raw[-1] ^= 1
+        tampered = crypto.crypt.ENVELOPE_HEADER + base64.b64encode(bytes(raw)).decode()
+
+        self.assertEqual(crypto.crypt.decrypt(tampered, data_key), 'Could not decrypt the message.')
+
+    def test_legacy_ciphertext_is_decrypted_with_rsa(self):
+        legacy = crypto.crypt.encrypt('hello')
+
+        self.assertFalse(legacy.startswith(crypto.crypt.ENVELOPE_HEADER))
+        self.assertEqual(crypto.crypt.decrypt(legacy), 'hello')
+        # Rooms that got a data key later still hold messages stored before it.
+        self.assertEqual(crypto.crypt.decrypt(legacy, crypto.crypt.generate_data_key()), 'hello')
+
+
+class PlaintextCacheTests(SimpleTestCase):
+    """
+    Checks the LRU order, the limits and the zeroing of evicted entries of `PlaintextCache`.
+    """
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = PlaintextCache(max_entries=2)
+        cache.put(b'a', 'first')
+        cache.put(b'b', 'second')
+        self.assertEqual(cache.get(b'a'), 'first')
+        cache.put(b'c', 'third')
+
+        self.assertIsNone(cache.get(b'b'))
+        self.assertEqual(cache.get(b'a'), 'first')
+        self.assertEqual(cache.get(b'c'), 'third')
+        self.assertEqual(cache.stats(), {'hits': 3, 'misses': 1, 'evictions': 1, 'entries': 2, 'bytes': 10})
+
+    def test_byte_cap(self):
+        cache = PlaintextCache(max_bytes=10)
+        cache.put(b'a', 'x' * 6)
+        cache.put(b'b', 'y' * 6)
+        cache.put(b'c', 'z' * 11)
+
+        self.assertIsNone(cache.get(b'a'))
+        self.assertEqual(cache.get(b'b'), 'y' * 6)
+        self.assertIsNone(cache.get(b'c'))
+        self.assertEqual(cache.stats()['bytes'], 6)
+
+    def test_evicted_plaintext_is_zeroed(self):
+        cache = PlaintextCache(max_entries=1, zero_on_evict=True)
+        cache.put(b'a', 'secret')
+        buf = cache._entries[b'a']
+        cache.put(b'b', 'other')
+
+        self.assertEqual(buf, bytearray(6))
+
+    def test_keys_depend_on_the_data_key(self):
+        self.assertNotEqual(PlaintextCache.make_key('v2:abc', 'k1'), PlaintextCache.make_key('v2:abc', 'k2'))
+        self.assertNotEqual(PlaintextCache.make_key('abc'), PlaintextCache.make_key('abc', 'k1'))
+
+
+class CryptoExecutorTests(SimpleTestCase):
+    """
+    Checks the bounded queue of `CryptoExecutor`.
+    """
+
+    def test_saturation_and_release(self):
+        executor = CryptoExecutor(max_pending=1)
+        self.addCleanup(executor.shutdown)
+
+        async def scenario():
+            first = asyncio.ensure_future(executor.run(time.sleep, 0.2))
+            await asyncio.sleep(0)
+            with self.assertRaises(ExecutorSaturated):
+                await executor.run(str, 1)
+            await first
+            return await executor.run(str, 2)
+
+        self.assertEqual(asyncio.run(scenario()), '2')
+        self.assertEqual(executor.stats()['pending'], 0)
+        self.assertEqual(executor.stats()['rejected'], 1)
+
+    def test_refused_submission_releases_its_slot(self):
+        executor = CryptoExecutor(max_pending=1)
+        executor._get_pool().shutdown()
+        self.addCleanup(executor.shutdown)
+
+        async def scenario():
+            for _ in range(2):
+                with self.assertRaises(RuntimeError):
+                    await executor.run(str, 1)
+
+        asyncio.run(scenario())
+        self.assertEqual(executor.stats()['pending'], 0)
+
+
+class ChatConsumerRefusalTests(SimpleTestCase):
+    """
+    Checks that refused WebSocket connections are closed with a code telling clients not to retry.
+    """
+
+    def close_code(self, user):
+        class RefusedChatConsumer(ChatConsumer):
+            async def get_user_and_room(self, room_name):
+                return user, None
+
+        async def scenario():
+            application = URLRouter([
+                re_path(r'^ws/chat/(?P<room_name>\w+)/$', RefusedChatConsumer.as_asgi(channel_layer_alias=None))
+            ])
+            communicator = WebsocketCommunicator(application, '/ws/chat/1/')
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            output = await communicator.receive_output()
+            await communicator.disconnect()
+            return output
+
+        output = asyncio.run(scenario())
+        self.assertEqual(output['type'], 'websocket.close')
+        return output['code']
+
+    def test_close_codes(self):
+        self.assertEqual(self.close_code(None), CLOSE_NOT_AUTHENTICATED)
+        self.assertEqual(self.close_code(User(user_name='carol')), CLOSE_ROOM_NOT_FOUND)
+
+
+class SQLiteChannelLayerTests(SimpleTestCase):
+    """
+    Checks the SQLite channel layer within one process and across several processes.
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'channels.sqlite3')
+
+    def make_layer(self, **kwargs):
+        layer = SQLiteChannelLayer(self.path, **kwargs)
+        self.addCleanup(layer._executor.shutdown)
+        return layer
+
+    def test_send_and_receive(self):
+        async def scenario():
+            layer = self.make_layer()
+            channel = await layer.new_channel()
+            await layer.send(channel, {'type': 'test', 'n': 1, 'raw': b'\x00\xff'})
+            await layer.send(channel, {'type': 'test', 'n': 2})
+            first = await asyncio.wait_for(layer.receive(channel), 5)
+            second = await asyncio.wait_for(layer.receive(channel), 5)
+            await layer.close()
+            return first, second
+
+        first, second = asyncio.run(scenario())
+        self.assertEqual(first, {'type': 'test', 'n': 1, 'raw': b'\x00\xff'})
+        self.assertEqual(second['n'], 2)
+
+    def test_capacity_and_expiry(self):
+        async def scenario():
+            layer = self.make_layer(capacity=2, expiry=0.2)
+            channel = await layer.new_channel()
+            await layer.send(channel, {'type': 'test'})
+            await layer.send(channel, {'type': 'test'})
+            with self.assertRaises(ChannelFull):
+                await layer.send(channel, {'type': 'test'})
+
+            await asyncio.sleep(0.3)
+            await layer.send(channel, {'type': 'test', 'fresh': True})
+            message = await asyncio.wait_for(layer.receive(channel), 5)
+            await layer.close()
+            return message
+
+        self.assertEqual(asyncio.run(scenario()), {'type': 'test', 'fresh': True})
+
+    def test_group_discard(self):
+        async def scenario():
+            layer = self.make_layer()
+            kept, dropped = await layer.new_channel(), await layer.new_channel()
+            await layer.group_add('room', kept)
+            await layer.group_add('room', dropped)
+            await layer.group_discard('room', dropped)
+            await layer.group_send('room', {'type': 'test'})
+            message = await asyncio.wait_for(layer.receive(kept), 5)
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(layer.receive(dropped), 0.3)
+            await layer.close()
+            return message
+
+        self.assertEqual(asyncio.run(scenario()), {'type': 'test'})
+
+    def test_group_send_reaches_other_processes(self):
+        context = multiprocessing.get_context('spawn')
+        results = context.Queue()
+        members = []
+        for _ in range(3):
+            ready = context.Event()
+            process = context.Process(target=run_group_member, args=(self.path, 'room', ready, results))
+            process.start()
+            members.append((process, ready))
+
+        for process, ready in members:
+            self.assertTrue(ready.wait(30))
+
+        async def broadcast():
+            layer = self.make_layer()
+            await layer.group_send('room', {'type': 'chat.message', 'text': 'hello'})
+            await layer.close()
+
+        asyncio.run(broadcast())
+        received = [results.get(timeout=10) for _ in members]
+
+        for process, _ in members:
+            process.join(10)
+            self.assertEqual(process.exitcode, 0)
+
+        self.assertEqual({pid for pid, _ in received}, {process.pid for process, _ in members})
+        self.assertEqual({text for _, text in received}, {'hello'})
+
+    def test_chat_consumers_in_other_processes_receive_group_messages(self):
+        context = multiprocessing.get_context('spawn')
+        results = context.Queue()
+        members = []
+        for _ in range(2):
+            ready = context.Event()
+            process = context.Process(target=run_chat_member, args=(self.path, 7, ready, results))
+            process.start()
+            members.append((process, ready))
+
+        for process, ready in members:
+            self.assertTrue(ready.wait(30))
+
+        async def broadcast():
+            layer = self.make_layer()
+            frame = json.dumps({'message': 'hello', 'sender': 'alice', 'timestamp': '2026-10-18T12:00:00+00:00'})
+            await layer.group_send('chat_7', {'type': 'chat_message', 'text': frame})
+            await layer.close()
+
+        asyncio.run(broadcast())
+        received = [results.get(timeout=10) for _ in members]
+
+        for process, _ in members:
+            process.join(10)
+            self.assertEqual(process.exitcode, 0)
+
+        self.assertEqual({pid for pid, _ in received}, {process.pid for process, _ in members})
+        self.assertEqual({message for _, message in received}, {'hello'})
+
+
+# The read-only replica is a second connection to the in-memory test database, which cannot
+# see the test case's open transaction, so reads stay on the default connection.
+@override_settings(DATABASE_ROUTERS=[])
+class ChatDataTestCase(TestCase):
+    """
+    Base class for tests of the chat views: alice and bob share a room, carol is not in it.
+    """
+
+    def setUp(self):
+        token_cache.clear()
+        self.addCleanup(token_cache.clear)
+        self.alice = User.objects.create(user_name='alice')
+        self.bob = User.objects.create(user_name='bob')
+        self.carol = User.objects.create(user_name='carol')
+        self.room, _ = ChatRoom.get_or_create_between('alice', 'bob')
+
+    def log_in(self, user):
+        session = self.client.session
+        session['token'] = [user.token]
+        session.save()
+
+    def add_messages(self, *texts, timestamps=None):
+        """
+        Saves `texts` in the room, alternately from alice and bob, and returns the messages.
+        """
+        timestamps = timestamps or [timezone.now() + timedelta(seconds=i) for i in range(len(texts))]
+        senders = [self.alice, self.bob]
+        return write_messages([
+            PendingMessage(self.room, senders[i % 2], crypto.crypt.encrypt(text, self.room.data_key), timestamp)
+            for i, (text, timestamp) in enumerate(zip(texts, timestamps))
+        ])
+
+
+class RoomHistoryPaginationTests(ChatDataTestCase):
+    """
+    Checks the keyset pagination and the access rules of `get_room_messages`.
+    """
+
+    def setUp(self):
+        super().setUp()
+        now = timezone.now()
+        # Messages 1 to 3 share a timestamp, so pages must break ties on the ID.
+        timestamps = [now, now + timedelta(seconds=1), now + timedelta(seconds=1), now + timedelta(seconds=1),
+                      now + timedelta(seconds=2)]
+        self.messages = self.add_messages('m0', 'm1', 'm2', 'm3', 'm4', timestamps=timestamps)
+        self.log_in(self.alice)
+
+    def get_page(self, **params):
+        response = self.client.get(f'/get_room_messages/{self.room.id}/', params)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        return [message['content'] for message in data['messages']], data['has_more']
+
+    def test_latest_page(self):
+        self.assertEqual(self.get_page(limit=2), (['m3', 'm4'], True))
+        newest = self.client.get(f'/get_room_messages/{self.room.id}/').json()['messages'][-1]
+        # ISO timestamps, as in live frames, so clients can recognize messages they got live.
+        self.assertEqual(newest['timestamp'], self.messages[4].timestamp.isoformat())
+        self.assertEqual(self.get_page(), (['m0', 'm1', 'm2', 'm3', 'm4'], False))
+
+    def test_before_cursor(self):
+        self.assertEqual(self.get_page(before=self.messages[3].id, limit=2), (['m1', 'm2'], True))
+        self.assertEqual(self.get_page(before=self.messages[1].id, limit=2), (['m0'], False))
+        self.assertEqual(self.get_page(before=self.messages[0].id), ([], False))
+
+    def test_after_cursor(self):
+        self.assertEqual(self.get_page(after=self.messages[1].id, limit=2), (['m2', 'm3'], True))
+        self.assertEqual(self.get_page(after=self.messages[2].id), (['m3', 'm4'], False))
+        self.assertEqual(self.get_page(after=self.messages[4].id), ([], False))
+
+    def test_cursor_of_another_room_yields_nothing(self):
+        other, _ = ChatRoom.get_or_create_between('bob', 'carol')
+        foreign = write_messages([PendingMessage(other, self.bob, crypto.crypt.encrypt('x', other.data_key), timezone.now())])
+        self.assertEqual(self.get_page(before=foreign[0].id), ([], False))
+
+    def test_invalid_parameters_are_rejected(self):
+        url = f'/get_room_messages/{self.room.id}/'
+        for params in ({'before': 'x'}, {'after': '1.5'}, {'limit': 'ten'}, {'limit': 0},
+                       {'before': self.messages[3].id, 'after': self.messages[1].id}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get(url, params).status_code, 400)
+
+    def test_only_participants_can_read(self):
+        url = f'/get_room_messages/{self.room.id}/'
+        etag = self.client.get(url)['ETag']
+
+        self.client.logout()
+        self.assertEqual(self.client.get(url).status_code, 401)
+        self.log_in(self.carol)
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.get(url, headers={'if-none-match': etag}).status_code, 404)
+
+
+class MessageWriterTests(ChatDataTestCase):
+    """
+    Checks the failure handling and the exit flush of the write-behind `MessageWriter`.
+    """
+
+    def pending(self, room, text):
+        return PendingMessage(room, self.alice, crypto.crypt.encrypt(text, room.data_key), timezone.now())
+
+    def test_failing_room_does_not_drop_the_batch(self):
+        other, _ = ChatRoom.get_or_create_between('alice', 'carol')
+        batch = [self.pending(self.room, 'a'), self.pending(other, 'b'), self.pending(self.room, 'c')]
+
+        def write(pending):
+            if any(p.room.id == other.id for p in pending):
+                raise RuntimeError('boom')
+            return write_messages(pending)
+
+        with mock.patch('chat.persistence.write_messages', write), self.assertLogs(level='ERROR'):
+            saved = MessageWriter._write_batch(batch)
+
+        self.assertIsNone(saved[1])
+        self.assertEqual([saved[0].sequence, saved[2].sequence], [1, 2])
+
+    def test_exit_writes_batches_taken_by_flush(self):
+        writer = MessageWriter()
+        writer._in_flight[0] = [self.pending(self.room, 'taken')]
+        writer._pending = [(self.pending(self.room, 'queued'), None)]
+        writer._flush_on_exit()
+
+        self.assertEqual(writer._in_flight, {})
+        self.assertEqual(list(self.room.message_set.order_by('sequence').values_list('sequence', flat=True)), [1, 2])
+        self.assertIsNone(writer._write_in_flight(0))
+
+
+class ConditionalRequestTests(ChatDataTestCase):
+    """
+    Checks the ETags of the inbox and the room history and the 304 responses they allow.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.add_messages('a')
+        self.log_in(self.alice)
+
+    def assertRevalidates(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        response = self.client.get(url, headers={'if-none-match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+
+        self.add_messages('b')
+        response = self.client.get(url, headers={'if-none-match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_room_history(self):
+        self.assertRevalidates(f'/get_room_messages/{self.room.id}/')
+
+    def test_inbox(self):
+        self.assertRevalidates('/get_user_chat_rooms')
+
+    def test_inbox_etag_depends_on_the_user(self):
+        etag = self.client.get('/get_user_chat_rooms')['ETag']
+        self.log_in(self.bob)
+
+        self.assertEqual(self.client.get('/get_user_chat_rooms', headers={'if-none-match': etag}).status_code, 200)
+
+
+class ChatRoomPairKeyTests(ChatDataTestCase):
+    """
+    Checks that a pair of users has exactly one room, whatever order the names come in.
+    """
+
+    def test_key_is_canonical_and_unambiguous(self):
+        self.assertEqual(ChatRoom.make_pair_key('bob', 'alice'), ChatRoom.make_pair_key('alice', 'bob'))
+        self.assertNotEqual(ChatRoom.make_pair_key('a:b', 'c'), ChatRoom.make_pair_key('a', 'b:c'))
+
+    def test_pair_has_one_room(self):
+        room, created = ChatRoom.get_or_create_between('bob', 'alice')
+
+        self.assertFalse(created)
+        self.assertEqual(room.id, self.room.id)
+        with self.assertRaises(IntegrityError):
+            ChatRoom.objects.create(user1='bob', user2='alice', pair_key=ChatRoom.make_pair_key('bob', 'alice'))
+
+
+class MessageSequenceTests(ChatDataTestCase):
+    """
+    Checks the per-room message sequence numbers and the delta sync built on them.
+    """
+
+    def test_sequences_are_per_room_and_contiguous(self):
+        other, _ = ChatRoom.get_or_create_between('alice', 'carol')
+        first = self.add_messages('a', 'b')
+        write_messages([PendingMessage(other, self.alice, crypto.crypt.encrypt('x', other.data_key), timezone.now())])
+        second = self.add_messages('c')
+
+        self.assertEqual([message.sequence for message in first + second], [1, 2, 3])
+        self.assertEqual(ChatRoom.objects.get(id=self.room.id).last_sequence, 3)
+        self.assertEqual(ChatRoom.objects.get(id=other.id).last_sequence, 1)
+        self.assertEqual(ChatRoom.allocate_sequences(self.room.id, 5), 4)
+        self.assertEqual(ChatRoom.objects.get(id=self.room.id).last_sequence, 8)
+
+    def test_messages_since(self):
+        self.add_messages('a', 'b', 'c')
+
+        messages, has_more = self.room.messages_since(1, 1)
+        self.assertEqual(([message['sequence'] for message in messages], has_more), ([2], True))
+        messages, has_more = self.room.messages_since(1, 5)
+        self.assertEqual(([message['sequence'] for message in messages], has_more), ([2, 3], False))
+        self.assertEqual(self.room.messages_since(3, 5), ([], False))
+
+    def test_sync_room_messages(self):
+        self.add_messages('a', 'b', 'c')
+        self.log_in(self.bob)
+        url = f'/sync_room_messages/{self.room.id}/'
+
+        data = self.client.get(url, {'since': 1}).json()
+        self.assertEqual([message['content'] for message in data['messages']], ['b', 'c'])
+        self.assertEqual((data['has_more'], data['last_sequence']), (False, 3))
+        self.assertEqual(self.client.get(url, {'since': 3}).json()['messages'], [])
+        for params in ({}, {'since': -1}, {'since': 'x'}, {'since': 0, 'limit': 0}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get(url, params).status_code, 400)
+
+    def test_sync_room_messages_requires_a_participant(self):
+        self.add_messages('a')
+        url = f'/sync_room_messages/{self.room.id}/'
+
+        self.assertEqual(self.client.get(url, {'since': 0}).status_code, 401)
+        self.log_in(self.carol)
+        self.assertEqual(self.client.get(url, {'since': 0}).status_code, 404)
+
+
+caesar_shift = import_module('chat.migrations.0014_chatroom_pair_key').caesar_shift
+
+
+class PairKeyMigrationTests(TransactionTestCase):
+    """
+    Checks that migration 0014 merges the duplicate rooms of a pair into the oldest one.
+    """
+    migrate_from = [('chat', '0013_alter_message_timestamp')]
+    migrate_to = [('chat', '0014_chatroom_pair_key')]
+
+    def setUp(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_from)
+        self.apps = executor.loader.project_state(self.migrate_from).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def migrate(self):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(self.migrate_to)
+        return executor.loader.project_state(self.migrate_to).apps
+
+    def test_duplicate_rooms_are_merged(self):
+        User = self.apps.get_model('chat', 'User')
+        ChatRoom = self.apps.get_model('chat', 'ChatRoom')
+        Message = self.apps.get_model('chat', 'Message')
+
+        alice = User.objects.create(user_name='alice', token='a')
+        bob = User.objects.create(user_name='bob', token='b')
+        now = timezone.now()
+        kept = ChatRoom.objects.create(user1='alice', user2='bob', encryption_key=3,
+                                       data_key=crypto.crypt.generate_data_key())
+        # A duplicate in reverse order, with the legacy `str(user)` value `get_or_create_room` stored.
+        duplicate = ChatRoom.objects.create(user1='bob', user2=f'User object ({alice.id})', encryption_key=5,
+                                            data_key=crypto.crypt.generate_data_key())
+        other = ChatRoom.objects.create(user1='alice', user2='carol')
+        Message.objects.create(room=kept, sender=alice, timestamp=now,
+                               text=crypto.crypt.encrypt(caesar_shift('hello', 3), kept.data_key))
+        Message.objects.create(room=duplicate, sender=bob, timestamp=now + timedelta(seconds=1),
+                               text=crypto.crypt.encrypt(caesar_shift('hi', 5), duplicate.data_key))
+
+        apps = self.migrate()
+        ChatRoom = apps.get_model('chat', 'ChatRoom')
+        Message = apps.get_model('chat', 'Message')
+
+        self.assertEqual(
+            set(ChatRoom.objects.values_list('id', 'pair_key')),
+            {(kept.id, '5:alice:bob'), (other.id, '5:alice:carol')}
+        )
+        room = ChatRoom.objects.get(id=kept.id)
+        messages = list(Message.objects.filter(room=room).order_by('timestamp'))
+        self.assertEqual(
+            [crypto.crypt.decrypt(message.text, room.data_key) for message in messages],
+            [caesar_shift('hello', 3), caesar_shift('hi', 3)]
+        )
+        self.assertEqual(room.last_message_id, messages[-1].id)
 
-# Create your tests here.
@@ -0,0 +1,168 @@
+# typeahead.py
+import threading
+import time
+from bisect import bisect_left
+from heapq import merge
+from itertools import groupby
+
+from .models import User
+
+# Upper bound appended to a prefix to turn "starts with" into an index range scan.
+PREFIX_UPPER_BOUND = '\U0010ffff'
+
+
+class UsernameIndex:
+    """
+    An in-memory, sorted index of case-folded usernames for prefix search.
+
+    The index is loaded from the database on first use. Every `refresh_interval` seconds
+    the users registered since (by ID) are merged in, so registrations in other processes
+    show up eventually; registrations in this process are added immediately through `add`.
+    Loads and refreshes are single-flight: one request does the work while the others keep
+    searching the current keys. Lookups are a binary search followed by a scan of at most
+    `limit` entries.
+
+    Users are never removed by a refresh; `clear` drops the index so the next search
+    rebuilds it.
+
+    Attributes:
+        refresh_interval (float): Seconds between incremental refreshes from the database.
+    """
+
+    # Up to this many new users are inserted in place; more are merged into a new list.
+    INSERT_LIMIT = 1000
+
+    def __init__(self, refresh_interval=300):
+        self.refresh_interval = refresh_interval
+        self._keys = []
+        self._max_id = 0
+        self._added = []
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def search(self, prefix, limit=10):
+        """
+        Returns the users whose username starts with `prefix`, ignoring case.
+
+        Args:
+            prefix (str): The beginning of the username.
+            limit (int): Maximum number of matches to return.
+
+        Returns:
+            list: Up to `limit` `(id, user_name)` tuples, ordered by folded username.
+        """
+        self._ensure_loaded()
+        prefix = prefix.casefold()
+
+        with self._lock:
+            keys = self._keys
+            start = bisect_left(keys, (prefix,))
+            matches = []
+            for folded, user_name, user_id in keys[start:start + limit]:
+                if not folded.startswith(prefix):
+                    break
+                matches.append((user_id, user_name))
+        return matches
+
+    def add(self, user):
+        """
+        Adds a newly registered user to the index, if it is loaded.
+        """
+        key = (user.user_name.casefold(), user.user_name, user.id)
+        with self._lock:
+            if self._loaded_at is not None:
+                _insert(self._keys, key)
+                self._added.append(key)
+
+    def clear(self):
+        """
+        Drops the index; it is reloaded on the next search.
+        """
+        with self._load_lock, self._lock:
+            self._keys = []
+            self._max_id = 0
+            self._added = []
+            self._loaded_at = None
+
+    def _ensure_loaded(self):
+        loaded_at = self._loaded_at
+        if loaded_at is None:
+            # Nothing to serve yet: wait for whichever request is loading.
+            with self._load_lock:
+                if self._loaded_at is None:
+                    self._refresh()
+            return
+
+        if time.monotonic() - loaded_at < self.refresh_interval:
+            return
+        # Stale: one request refreshes, the others keep using the current keys.
+        if not self._load_lock.acquire(blocking=False):
+            return
+        try:
+            if self._loaded_at is not None and time.monotonic() - self._loaded_at >= self.refresh_interval:
+                self._refresh()
+        finally:
+            self._load_lock.release()
+
+    def _refresh(self):
+        """
+        Loads the users with an ID above the highest loaded one. Called with `_load_lock` held.
+        """
+        rows = sorted(User.objects.filter(id__gt=self._max_id).values_list(
+            'user_name_folded', 'user_name', 'id'
+        ))
+        max_id = max((user_id for _, _, user_id in rows), default=self._max_id)
+
+        if len(rows) <= self.INSERT_LIMIT:
+            with self._lock:
+                for key in rows:
+                    _insert(self._keys, key)
+        else:
+            with self._lock:
+                keys, self._added = self._keys, []
+            merged = [key for key, _ in groupby(merge(keys, rows))]
+            with self._lock:
+                # Users added while the merge ran are not in `keys`.
+                for key in self._added:
+                    _insert(merged, key)
+                self._keys = merged
+
+        with self._lock:
+            self._added = []
+            self._max_id = max_id
+            self._loaded_at = time.monotonic()
+
+
+def _insert(keys, key):
+    """
+    Inserts `key` into the sorted list `keys` unless it is already there.
+    """
+    position = bisect_left(keys, key)
+    if position == len(keys) or keys[position] != key:
+        keys.insert(position, key)
+
+
+username_index = UsernameIndex()
+
+
+def search_usernames(prefix, limit=10, use_index=True):
+    """
+    Finds users whose username starts with `prefix`, ignoring case.
+
+    Args:
+        prefix (str): The beginning of the username.
+        limit (int): Maximum number of matches to return.
+        use_index (bool): Whether to answer from the in-memory index instead of the database.
+
+    Returns:
+        list: Up to `limit` `(id, user_name)` tuples, ordered by folded username.
+    """
+    if use_index:
+        return username_index.search(prefix, limit)
+
+    prefix = prefix.casefold()
+    return list(User.objects.filter(
+        user_name_folded__gte=prefix,
+        user_name_folded__lt=prefix + PREFIX_UPPER_BOUND
+    ).order_by('user_name_folded', 'id').values_list('id', 'user_name')[:limit])
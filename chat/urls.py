@@ -8,8 +8,15 @@ urlpatterns = [
     path('', views.index, name='index'),
     path('login', views.login, name='login'),
     path('search_user/', views.search_user, name='search_user'),
+    path('search_users_prefix/', views.search_users_prefix, name='search_users_prefix'),
     path('chat/<int:user_id>/', views.chat_room, name='chat_room'),
     path('get_room_messages/<int:room_id>/', views.get_room_messages, name='get_room_messages'),
+    path('sync_room_messages/<int:room_id>/', views.sync_room_messages, name='sync_room_messages'),
+    path('stream_room_messages/<int:room_id>/', views.stream_room_messages, name='stream_room_messages'),
     path('get_user_chat_rooms', views.get_user_chat_rooms, name='get_user_chat_rooms'),
+    path('metrics', views.metrics, name='metrics'),
+    path('query_reports/', views.query_reports, name='query_reports'),
+    path('profiling/', views.profiling_status, name='profiling_status'),
+    path('profiling/<str:name>', views.profiling_download, name='profiling_download'),
 
 ]
\ No newline at end of file
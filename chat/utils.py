@@ -1,13 +1,166 @@
 # utils.py
+import functools
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.shortcuts import redirect
+
 from .models import User
 
 
-def get_user_from_session(request):
-    token = request.session.get('token')
-    if token:
-        try:
-            user = User.objects.get(token=token)
+class TokenCache:
+    """
+    A process-local cache mapping session tokens to users, with a time-to-live.
+
+    Entries expire after `ttl` seconds, so a token rotated by another process stops
+    resolving within that window. Tokens rotated in this process are dropped immediately
+    through `invalidate`.
+
+    Attributes:
+        ttl (float): Number of seconds an entry stays valid.
+        max_entries (int): Maximum number of cached tokens; the oldest entries are dropped first.
+    """
+
+    def __init__(self, ttl=60, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        """
+        Returns the cached user for a token, or None if it is missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            user, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[token]
+                return None
             return user
-        except User.DoesNotExist:
-            return None
-    return None
+
+    def set(self, token, user):
+        """
+        Caches the user a token resolves to.
+        """
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                del self._entries[next(iter(self._entries))]
+            self._entries[token] = (user, time.monotonic() + self.ttl)
+
+    def invalidate(self, token):
+        """
+        Drops a token from the cache, e.g. when it is rotated on login.
+        """
+        with self._lock:
+            self._entries.pop(token, None)
+
+    def clear(self):
+        """
+        Drops every cached token.
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache(ttl=getattr(settings, 'CHAT_TOKEN_CACHE_TTL', 60))
+
+
+def get_session_token(session):
+    """
+    Returns the authentication token stored in a session, or None.
+
+    The login view stores the token as a one-element list.
+    """
+    token = session.get('token')
+    if isinstance(token, (list, tuple)):
+        token = token[0] if token else None
+    return token
+
+
+def get_user_from_token(token):
+    """
+    Resolves the user authenticated by a session token.
+
+    Lookups go through `token_cache` first and fall back to the indexed `User.token` column.
+
+    Args:
+        token (str): The session token.
+
+    Returns:
+        User: The authenticated user, or None if the token is missing or unknown.
+    """
+    if not token:
+        return None
+
+    user = token_cache.get(token)
+    if user is not None:
+        return user
+
+    try:
+        user = User.objects.get(token=token)
+    except User.DoesNotExist:
+        return None
+
+    token_cache.set(token, user)
+    return user
+
+
+def get_user_from_session(request):
+    """
+    Resolves the user authenticated by the session token of a request.
+
+    Args:
+        request (HttpRequest): The request whose session holds the token.
+
+    Returns:
+        User: The authenticated user, or None if the token is missing or unknown.
+    """
+    return get_user_from_token(get_session_token(request.session))
+
+
+def chat_admin_required(view):
+    """
+    Decorates a view so only the users named in CHAT_ADMINS can open it.
+
+    Relies on `request.chat_user`, set by `ChatUserMiddleware`. Anonymous requests are
+    redirected to the login page; other users get a 403.
+    """
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        user = request.chat_user
+        if user is None:
+            return redirect('/login')
+        if user.user_name not in settings.CHAT_ADMINS:
+            raise PermissionDenied
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+def is_rate_limited(key, limit, window):
+    """
+    Counts a hit for `key` and reports whether it exceeded `limit` hits in the current window.
+
+    Uses a fixed window in the default Django cache, so the limit is shared by every
+    process that shares the cache backend.
+
+    Args:
+        key (str): Identifies the caller and the action, e.g. 'typeahead:42'.
+        limit (int): Maximum number of hits allowed per window.
+        window (int): Length of the window in seconds.
+
+    Returns:
+        bool: True if the caller is over the limit.
+    """
+    cache_key = f'ratelimit:{key}:{int(time.time() // window)}'
+    if cache.add(cache_key, 1, timeout=window):
+        return False
+    try:
+        return cache.incr(cache_key) > limit
+    except ValueError:
+        return False
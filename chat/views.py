@@ -1,15 +1,52 @@
+import hashlib
+import json
 import logging
+import os
 
+from channels.db import database_sync_to_async
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q
-from django.http import JsonResponse
+from django.db.models import F, Q
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.conf import settings
 from django.shortcuts import get_object_or_404
 from django.shortcuts import render, redirect
+from django.utils.cache import get_conditional_response, patch_cache_control, quote_etag
 
-from crypto.crypt import decrypt
+from crypto.crypt import decrypt_many
+from . import metrics as chat_metrics, profiling, querylog
 from .forms import UserSearchForm
 from .models import ChatRoom, Message
 from .models import User
+from .routers import read_only
+from .typeahead import search_usernames, username_index
+from .utils import chat_admin_required, is_rate_limited, token_cache
+
+# Default and maximum number of messages returned per page by `get_room_messages`.
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
+
+# Number of messages fetched and decrypted at a time by `stream_room_messages`.
+HISTORY_STREAM_CHUNK_SIZE = 2000
+
+
+def not_modified(request, etag):
+    """
+    Returns a 304 response if the request's `If-None-Match` matches `etag`, otherwise None.
+    """
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        set_validator(response, etag)
+    return response
+
+
+def set_validator(response, etag):
+    """
+    Sets `etag` on a response and asks browsers to revalidate it on every use instead of
+    reusing it, and shared caches not to store it.
+    """
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
 
 
 def index(request):
@@ -18,7 +55,7 @@ def index(request):
 
     - Checks if the user has an active session with a valid token.
     - If not, redirects the user to the login page.
-    - If a valid session exists, retrieves the user based on the session token and renders the index page.
+    - If a valid session exists, renders the index page for the user resolved by `ChatUserMiddleware`.
 
     Args:
         request: The HTTP request object containing metadata about the request.
@@ -27,14 +64,8 @@ def index(request):
         - If the token is missing or invalid, the user is redirected to the login page.
         - If the token is valid, the index page is rendered with user information.
     """
-    if 'token' not in request.session:
-        return redirect('/login')
-
-    token = request.session['token'][0]
-
-    try:
-        user = User.objects.get(token=token)
-    except User.DoesNotExist:
+    user = request.chat_user
+    if user is None:
         return redirect('/login')
 
     context = {
@@ -85,6 +116,7 @@ def login(request):
 
         if method == 'log':
             if user_exist and password == user_data.password:
+                token_cache.invalidate(user_data.token)
                 request.session['token'] = [token]
                 user_data.token = token
                 user_data.save()
@@ -106,6 +138,7 @@ def login(request):
                 request.session['token'] = [token]
                 user_data.token = token
                 user_data.save()
+                username_index.add(user_data)
                 return redirect('/')
             else:
                 return render(request, 'login.html', {'error': 'User already exists'})
@@ -121,12 +154,19 @@ def create_token():
     return token
 
 
+@read_only
 def get_user_chat_rooms(request):
     """
     Retrieves and returns a list of chat rooms for the currently authenticated user.
 
-    This view fetches the chat rooms where the current user is either user1 or user2.
-    It also retrieves the most recent message for each chat room.
+    This view fetches the chat rooms where the current user is either user1 or user2,
+    most recently active first. The most recent message of each room is read from the
+    fields denormalized onto `ChatRoom`, so the whole inbox is a single query, served by the
+    read-only connection (see `chat.routers`).
+
+    The ETag is derived from the user and the ID and last sequence of each of their rooms,
+    so it changes when a room is added or gets a message. A request whose `If-None-Match`
+    matches gets a 304 after that one query, without decrypting any preview.
 
     Args:
         request (HttpRequest): The request object containing user session information.
@@ -134,24 +174,35 @@ def get_user_chat_rooms(request):
     Returns:
         JsonResponse: A JSON response containing the list of chat rooms with their details.
     """
-    user = User.objects.get(token=request.session['token'][0])
+    user = request.chat_user
+    if user is None:
+        return JsonResponse({'error': 'Not authenticated'}, status=401)
 
-    chat_rooms = ChatRoom.objects.filter(
+    chat_rooms = list(ChatRoom.objects.filter(
         Q(user1=user.user_name) | Q(user2=user.user_name)
-    ).prefetch_related('message_set').distinct()
+    ).order_by(F('last_message_at').desc(nulls_last=True), '-id'))
+
+    rooms_state = ','.join(f'{room.id}.{room.last_sequence}' for room in chat_rooms)
+    etag = quote_etag(hashlib.sha256(f'{user.id}:{rooms_state}'.encode()).hexdigest()[:32])
+    response = not_modified(request, etag)
+    if response is not None:
+        return response
+
+    previews = decrypt_many(
+        (room.last_message_text, room.data_key) for room in chat_rooms if room.last_message_id
+    )
 
     chat_room_data = []
     for room in chat_rooms:
-        last_message = room.message_set.last()
         chat_room_data.append({
             'id': room.id,
             'user_name': room.user2 if room.user1 == user.user_name else room.user1,
-            'last_message': decrypt(last_message.text) if last_message else '',
-            'last_message_time': last_message.timestamp.strftime('%H:%M') if last_message else '',
-            'msh': ChatRoom.objects.get(id=room.id).encryption_key
+            'last_message': next(previews) if room.last_message_id else '',
+            'last_message_time': room.last_message_at.strftime('%H:%M') if room.last_message_id else '',
+            'msh': room.encryption_key
         })
 
-    return JsonResponse({'chat_rooms': chat_room_data})
+    return set_validator(JsonResponse({'chat_rooms': chat_room_data}), etag)
 
 
 def get_or_create_room(user1, user2):
@@ -159,7 +210,8 @@ def get_or_create_room(user1, user2):
     Retrieves an existing chat room between two users or creates a new one if it does not exist.
 
     This function ensures that the provided user instances are valid and have proper IDs.
-    It uses the `get_or_create` method to either fetch an existing chat room or create a new one.
+    The room is resolved through `ChatRoom.get_or_create_between`, a single probe of the
+    unique pair key, which also keeps concurrent requests from creating two rooms.
 
     Args:
         user1 (User): The first user in the chat room.
@@ -178,10 +230,7 @@ def get_or_create_room(user1, user2):
     if user1.id is None or user2.id is None:
         raise ValueError("One or both users have invalid IDs")
 
-    chat_room, created = ChatRoom.objects.get_or_create(
-        user1=min(user1, user2, key=lambda u: u.id),
-        user2=max(user1, user2, key=lambda u: u.id)
-    )
+    chat_room, created = ChatRoom.get_or_create_between(user1.user_name, user2.user_name)
 
     return chat_room
 
@@ -236,25 +285,15 @@ def search_user(request):
 
             try:
                 user = User.objects.get(user_name=username)
-                my_user = User.objects.get(token=request.session['token'][0])
-
-                chat_room = ChatRoom.objects.filter(
-                    (Q(user1=my_user.user_name) & Q(user2=user.user_name)) |
-                    (Q(user1=user.user_name) & Q(user2=my_user.user_name))
-                ).first()
-
-                if not chat_room:
-                    import random
-                    shift_value = random.randint(1, 25)
-                    chat_room = ChatRoom.objects.create(
-                        user1=my_user.user_name,
-                        user2=user.user_name,
-                        encryption_key=shift_value
-                    )
-
-                last_message = Message.objects.filter(room=chat_room).last()
-                last_message_text = decrypt(last_message.text) if last_message else ''
-                last_message_time = last_message.timestamp.strftime('%H:%M') if last_message else ''
+                my_user = request.chat_user
+                if my_user is None:
+                    return JsonResponse({'success': False, 'error': 'Not authenticated'}, status=401)
+
+                chat_room, created = ChatRoom.get_or_create_between(my_user.user_name, user.user_name)
+
+                has_last_message = chat_room.last_message_id is not None
+                last_message_text = next(decrypt_many([(chat_room.last_message_text, chat_room.data_key)])) if has_last_message else ''
+                last_message_time = chat_room.last_message_at.strftime('%H:%M') if has_last_message else ''
 
                 user_data = {
                     'id': user.id,
@@ -286,29 +325,394 @@ def search_user(request):
     return JsonResponse({'success': False, 'error': 'Invalid request'})
 
 
+def search_users_prefix(request):
+    """
+    Returns the users whose username starts with the given text, for search typeahead.
+
+    The prefix match ignores case and is answered from the in-memory username index (or an
+    indexed range query on `User.user_name_folded` when the index is disabled). Requests are
+    rate-limited per user.
+
+    Query parameters:
+        q (str): The beginning of the username.
+        limit (int): Maximum number of matches, capped at `CHAT_TYPEAHEAD['MAX_RESULTS']`.
+
+    Args:
+        request (HttpRequest): The request object containing the query.
+
+    Returns:
+        JsonResponse: A JSON response with the matching users, 401 for anonymous requests
+        or 429 when the caller is over the rate limit.
+    """
+    user = request.chat_user
+    if user is None:
+        return JsonResponse({'error': 'Not authenticated'}, status=401)
+
+    typeahead_settings = settings.CHAT_TYPEAHEAD
+    if is_rate_limited(f'typeahead:{user.id}', typeahead_settings['RATE_LIMIT'], typeahead_settings['RATE_WINDOW']):
+        return JsonResponse({'error': 'Too many requests'}, status=429)
+
+    prefix = request.GET.get('q', '').strip()
+    try:
+        limit = min(int(request.GET.get('limit', typeahead_settings['MAX_RESULTS'])), typeahead_settings['MAX_RESULTS'])
+    except ValueError:
+        return JsonResponse({'error': 'Invalid limit'}, status=400)
+
+    if not prefix or limit < 1:
+        return JsonResponse({'users': []})
+
+    # Ask for one extra match in case the caller's own name is among them.
+    matches = search_usernames(prefix, limit + 1, use_index=typeahead_settings['USE_INDEX'])
+    users = [
+        {'id': user_id, 'user_name': user_name}
+        for user_id, user_name in matches if user_id != user.id
+    ][:limit]
+
+    return JsonResponse({'users': users})
+
+
+@read_only
 def get_room_messages(request, room_id):
     """
-    Retrieves and returns all messages in a specific chat room.
+    Retrieves and returns one page of messages in a specific chat room.
 
-    This view handles GET requests to fetch all messages for a given chat room.
-    It orders the messages by their timestamp and returns them in a JSON response.
+    This view handles GET requests to fetch the messages of a given chat room using keyset
+    pagination on `(timestamp, id)`. Without a cursor the latest page is returned. Pages are
+    always returned oldest first. Reads go to the read-only connection (see `chat.routers`).
+    Timestamps are in ISO format, as in the WebSocket frames, so clients can recognize
+    messages they got live.
+
+    Only the room's participants may read it. The ETag is the room's last sequence: a page
+    only changes when the room gets a message. A request whose `If-None-Match` matches gets
+    a 304 after the room lookup, without reading or decrypting any message.
+
+    Query parameters:
+        before (int): Return the messages older than the message with this ID.
+        after (int): Return the messages newer than the message with this ID.
+        limit (int): Page size, capped at `HISTORY_MAX_PAGE_SIZE`.
 
     Args:
         request (HttpRequest): The request object containing the room ID.
         room_id (int): The ID of the chat room for which messages are to be fetched.
 
     Returns:
-        JsonResponse: A JSON response containing a list of messages in the chat room.
+        JsonResponse: A JSON response containing the page of messages with their sequence
+        numbers, whether more messages exist past it, and the room key. Invalid parameters
+        yield a 400 response and anonymous requests a 401.
+
+    Raises:
+        Http404: If the room does not exist or the user is not one of its participants.
+    """
+    if request.method == 'GET':
+        user = request.chat_user
+        if user is None:
+            return JsonResponse({'error': 'Not authenticated'}, status=401)
+
+        cr = get_object_or_404(ChatRoom, Q(user1=user.user_name) | Q(user2=user.user_name), id=room_id)
+
+        try:
+            before = int(request.GET['before']) if 'before' in request.GET else None
+            after = int(request.GET['after']) if 'after' in request.GET else None
+            limit = min(int(request.GET.get('limit', HISTORY_PAGE_SIZE)), HISTORY_MAX_PAGE_SIZE)
+        except ValueError:
+            return JsonResponse({'error': 'Invalid pagination parameters'}, status=400)
+
+        if limit < 1 or (before is not None and after is not None):
+            return JsonResponse({'error': 'Invalid pagination parameters'}, status=400)
+
+        etag = quote_etag(f'{cr.id}.{cr.last_sequence}')
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
+
+        messages, has_more = get_message_page(cr, before=before, after=after, limit=limit)
+        contents = decrypt_many((message['text'] for message in messages), cr.data_key)
+
+        message_list = [{
+            'id': message['id'],
+            'sequence': message['sequence'],
+            'sender': message['sender__user_name'],
+            'content': content,
+            'timestamp': message['timestamp'].isoformat()
+        } for message, content in zip(messages, contents)]
+
+        return set_validator(
+            JsonResponse({'messages': message_list, 'has_more': has_more, 'key': cr.encryption_key}), etag
+        )
+
+
+@read_only
+def sync_room_messages(request, room_id):
+    """
+    Returns the messages of a chat room saved after a given sequence number.
+
+    Clients that already hold part of the history pass the sequence of their last message
+    and get only what they missed, e.g. after reconnecting. When the room has nothing newer,
+    which the room's `last_sequence` tells, no message is read at all. Timestamps are in ISO
+    format, as in the WebSocket frames, so clients can recognize messages they got live.
+
+    Query parameters:
+        since (int): The sequence of the last message the client has; 0 for the whole history.
+        limit (int): Maximum number of messages, capped at `HISTORY_MAX_PAGE_SIZE`.
+
+    Args:
+        request (HttpRequest): The request object.
+        room_id (int): The ID of the chat room.
+
+    Returns:
+        JsonResponse: The messages in sequence order, whether more follow them, the room's
+        last sequence and the room key. Invalid parameters yield a 400 response and
+        anonymous requests a 401.
+
+    Raises:
+        Http404: If the room does not exist or the user is not one of its participants.
     """
     if request.method == 'GET':
-        cr = get_object_or_404(ChatRoom, id=room_id)
+        user = request.chat_user
+        if user is None:
+            return JsonResponse({'error': 'Not authenticated'}, status=401)
+
+        cr = get_object_or_404(ChatRoom, Q(user1=user.user_name) | Q(user2=user.user_name), id=room_id)
 
-        messages = Message.objects.filter(room=cr).order_by('timestamp')
+        try:
+            since = int(request.GET['since'])
+            limit = min(int(request.GET.get('limit', HISTORY_MAX_PAGE_SIZE)), HISTORY_MAX_PAGE_SIZE)
+        except (KeyError, ValueError):
+            return JsonResponse({'error': 'Invalid sync parameters'}, status=400)
+
+        if since < 0 or limit < 1:
+            return JsonResponse({'error': 'Invalid sync parameters'}, status=400)
+
+        messages, has_more = cr.messages_since(since, limit) if since < cr.last_sequence else ([], False)
+        contents = decrypt_many((message['text'] for message in messages), cr.data_key)
 
         message_list = [{
-            'sender': message.sender.user_name,
-            'content': decrypt(message.text),
-            'timestamp': message.timestamp.strftime('%Y-%m-%d %H:%M:%S')
-        } for message in messages]
+            'id': message['id'],
+            'sequence': message['sequence'],
+            'sender': message['sender__user_name'],
+            'content': content,
+            'timestamp': message['timestamp'].isoformat()
+        } for message, content in zip(messages, contents)]
+
+        return JsonResponse({
+            'messages': message_list,
+            'has_more': has_more,
+            'last_sequence': cr.last_sequence,
+            'key': cr.encryption_key
+        })
+
 
-        return JsonResponse({'messages': message_list, 'key': cr.encryption_key})
+def get_message_page(room, before=None, after=None, limit=HISTORY_PAGE_SIZE):
+    """
+    Fetches one page of a room's messages with a single indexed range query.
+
+    The cursor is a message ID; its timestamp is looked up by primary key and the page is
+    selected with a `(timestamp, id)` row comparison, which the `(room, timestamp, id)` index
+    serves directly. Sender names are joined in the same query.
+
+    Args:
+        room (ChatRoom): The chat room to read from.
+        before (int, optional): Return the messages older than this message ID.
+        after (int, optional): Return the messages newer than this message ID.
+        limit (int): Maximum number of messages to return.
+
+    Returns:
+        tuple: The list of message dicts (`id`, `sequence`, `text`, `timestamp`, `sender__user_name`),
+        oldest first, and whether more messages exist beyond the page.
+    """
+    messages = Message.objects.filter(room=room)
+    cursor_id = after if after is not None else before
+
+    if cursor_id is not None:
+        cursor = Message.objects.filter(room=room, id=cursor_id).values_list('timestamp', flat=True).first()
+        if cursor is None:
+            return [], False
+        if after is not None:
+            messages = messages.filter(Q(timestamp__gt=cursor) | Q(timestamp=cursor, id__gt=cursor_id))
+        else:
+            messages = messages.filter(Q(timestamp__lt=cursor) | Q(timestamp=cursor, id__lt=cursor_id))
+
+    ordering = ('timestamp', 'id') if after is not None else ('-timestamp', '-id')
+    page = list(
+        messages.order_by(*ordering).values('id', 'sequence', 'text', 'timestamp', 'sender__user_name')[:limit + 1]
+    )
+
+    has_more = len(page) > limit
+    page = page[:limit]
+    if after is None:
+        page.reverse()
+
+    return page, has_more
+
+
+def stream_room_messages(request, room_id):
+    """
+    Streams the complete history of a chat room as JSON.
+
+    Intended for export tooling that needs whole histories; only the room's participants
+    may export it. The body is an async generator, so under ASGI each chunk is sent as soon
+    as it is ready. Messages are read by sequence range, then decrypted and serialized
+    `HISTORY_STREAM_CHUNK_SIZE` at a time on a worker thread, so memory use stays constant
+    regardless of the size of the room. The document has the same shape as the
+    `get_room_messages` response, without pagination fields.
+
+    Args:
+        request (HttpRequest): The request object containing the room ID.
+        room_id (int): The ID of the chat room to export.
+
+    Returns:
+        StreamingHttpResponse: A response streaming the room's messages, oldest first, or a
+        401 JSON response for anonymous requests.
+
+    Raises:
+        Http404: If the room does not exist or the user is not one of its participants.
+    """
+    if request.method == 'GET':
+        user = request.chat_user
+        if user is None:
+            return JsonResponse({'error': 'Not authenticated'}, status=401)
+
+        cr = get_object_or_404(ChatRoom, Q(user1=user.user_name) | Q(user2=user.user_name), id=room_id)
+        return StreamingHttpResponse(_iter_room_json(cr), content_type='application/json')
+
+
+async def _iter_room_json(room):
+    yield '{"key": %s, "messages": [' % json.dumps(room.encryption_key)
+
+    separator = ''
+    since = 0
+    while True:
+        chunk, since = await database_sync_to_async(_room_json_chunk)(room, since)
+        if chunk:
+            yield separator + chunk
+            separator = ', '
+        if since is None:
+            break
+
+    yield ']}'
+
+
+def _room_json_chunk(room, since):
+    """
+    Serializes the next `HISTORY_STREAM_CHUNK_SIZE` messages of a room after sequence `since`.
+
+    Returns:
+        tuple: The messages as comma-separated JSON objects, and the sequence to continue
+        from, or None after the last chunk.
+    """
+    messages, has_more = room.messages_since(since, HISTORY_STREAM_CHUNK_SIZE)
+    contents = decrypt_many((message['text'] for message in messages), room.data_key)
+    chunk = ', '.join(json.dumps({
+        'id': message['id'],
+        'sender': message['sender__user_name'],
+        'content': content,
+        'timestamp': message['timestamp'].strftime('%Y-%m-%d %H:%M:%S')
+    }) for message, content in zip(messages, contents))
+    return chunk, messages[-1]['sequence'] if has_more else None
+
+
+def metrics(request):
+    """
+    Exposes the process's metrics in the Prometheus text format.
+
+    Args:
+        request (HttpRequest): The scrape request.
+
+    Returns:
+        HttpResponse: The rendered `chat.metrics.registry`.
+
+    Raises:
+        Http404: If CHAT_METRICS['ENABLED'] is off.
+    """
+    if not chat_metrics.enabled:
+        raise Http404()
+    return HttpResponse(chat_metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@chat_admin_required
+def query_reports(request):
+    """
+    Shows the most recent query reports recorded by `QueryProfilerMiddleware` and the
+    consumer wrapper, newest first, with repeated (N+1) statements highlighted.
+
+    Only for the users in CHAT_ADMINS. A POST clears the buffer.
+
+    Args:
+        request (HttpRequest): The request object.
+
+    Returns:
+        HttpResponse: The rendered reports page.
+    """
+    if request.method == 'POST':
+        querylog.reports.clear()
+        return redirect(request.path)
+
+    return render(request, 'query_reports.html', {
+        'enabled': querylog.enabled,
+        'repeat_threshold': querylog.repeat_threshold,
+        'reports': querylog.reports.list(),
+    })
+
+
+@chat_admin_required
+def profiling_status(request):
+    """
+    Shows the sampling profiler's settings and the collapsed-stack files it wrote, and lets
+    the users in CHAT_ADMINS profile the next requests and frames on demand.
+
+    A POST with `count` profiles that many of this process's next HTTP requests and WebSocket
+    frames; `count=0` cancels captures still pending.
+
+    Args:
+        request (HttpRequest): The request object.
+
+    Returns:
+        HttpResponse: The rendered status page.
+    """
+    if request.method == 'POST':
+        try:
+            profiling.capture(int(request.POST.get('count', 0)))
+        except ValueError:
+            return HttpResponse('Invalid count', status=400)
+        return redirect(request.path)
+
+    return render(request, 'profiling.html', {
+        'enabled': profiling.enabled,
+        'sample_rate': profiling.sample_rate,
+        'interval': profiling.interval,
+        'header': profiling.header,
+        'pending_captures': profiling.pending_captures(),
+        'profiles': profiling.list_profiles(),
+    })
+
+
+@chat_admin_required
+def profiling_download(request, name):
+    """
+    Returns one collapsed-stack file written by the profiler, or all of them concatenated
+    when `name` is 'all', ready for flamegraph.pl or speedscope.
+
+    Args:
+        request (HttpRequest): The request object.
+        name (str): The file name, as listed by `profiling_status`.
+
+    Returns:
+        HttpResponse: The collapsed stacks as plain text.
+
+    Raises:
+        Http404: If no such file exists.
+    """
+    profiles = profiling.list_profiles()
+    if name == 'all':
+        names = profiles
+    elif name in profiles:
+        names = [name]
+    else:
+        raise Http404()
+
+    def lines():
+        for profile in names:
+            with open(os.path.join(profiling.output_dir, profile)) as f:
+                yield from f
+
+    return StreamingHttpResponse(lines(), content_type='text/plain; charset=utf-8')
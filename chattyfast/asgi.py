@@ -1,16 +1,19 @@
 import os
 from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chattyfast.settings')
+django_asgi_app = get_asgi_application()
+
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
 import chat.routing
-
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chattyfast.settings')
+from chat.profiling import ASGIProfilerMiddleware
 
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
+    "http": ASGIProfilerMiddleware(django_asgi_app),
     "websocket": AuthMiddlewareStack(
         URLRouter(
             chat.routing.websocket_urlpatterns
         )
     ),
-})
\ No newline at end of file
+})
@@ -43,8 +43,12 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'chat.middleware.MetricsMiddleware',
+    'chat.middleware.QueryProfilerMiddleware',
+    'chat.middleware.ProfilerMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'chat.middleware.ChatUserMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -76,13 +80,47 @@ WSGI_APPLICATION = 'chattyfast.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
+# SQLite tuned for concurrent traffic: WAL lets readers run alongside the message writer,
+# synchronous=NORMAL is durable across application crashes in WAL mode, and writers take
+# the lock up front (IMMEDIATE) so they wait on busy_timeout instead of failing on upgrade.
+# Connections are pooled per process by chat.backends.sqlite3; CONN_MAX_AGE stays 0 because
+# under ASGI each request runs on a new thread, where persistent connections would leak.
+SQLITE_PRAGMAS = (
+    'PRAGMA synchronous=NORMAL;'
+    'PRAGMA busy_timeout=5000;'
+    'PRAGMA mmap_size=268435456;'
+    'PRAGMA cache_size=-16000;'
+    'PRAGMA temp_store=MEMORY'
+)
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'chat.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'CONN_MAX_AGE': 0,
+        'POOL_SIZE': 8,
+        'OPTIONS': {
+            'init_command': 'PRAGMA journal_mode=WAL;' + SQLITE_PRAGMAS,
+            'transaction_mode': 'IMMEDIATE',
+        },
+    },
+    # The same file, opened read-only, for views decorated with chat.routers.read_only.
+    'replica': {
+        'ENGINE': 'chat.backends.sqlite3',
+        'NAME': f"file:{BASE_DIR / 'db.sqlite3'}?mode=ro",
+        'CONN_MAX_AGE': 0,
+        'POOL_SIZE': 8,
+        'OPTIONS': {
+            'init_command': 'PRAGMA query_only=1;' + SQLITE_PRAGMAS,
+        },
+        'TEST': {
+            'MIRROR': 'default',
+        },
+    },
 }
 
+DATABASE_ROUTERS = ['chat.routers.ReadOnlyRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -131,10 +169,101 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 ASGI_APPLICATION = "chattyfast.asgi.application"
 
+# Shared between all worker processes on the box through a local SQLite file (see chat.layers).
 CHANNEL_LAYERS = {
     "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer"
+        "BACKEND": "chat.layers.SQLiteChannelLayer",
+        "CONFIG": {
+            "path": BASE_DIR / "channels.sqlite3",
+            "expiry": 60,
+            "group_expiry": 86400,
+            "capacity": 100,
+        },
     }
 }
+
+# Backend used by crypto.crypt for RSA operations: 'rsa' (pure Python) or 'openssl'.
+CRYPTO_BACKEND = 'openssl'
+
+# Bounds of the in-process cache of decrypted message plaintext (see crypto.cache).
+CRYPTO_PLAINTEXT_CACHE = {
+    'MAX_ENTRIES': 10000,
+    'MAX_BYTES': 8 * 1024 * 1024,
+    'ZERO_ON_EVICT': False,
+}
+
+# Process pool used by crypto.crypt.decrypt_many for large message histories. History pages
+# (at most 200 messages) stay below SERIAL_THRESHOLD; only the export stream uses the pool.
+CRYPTO_DECRYPT_POOL = {
+    'WORKERS': os.cpu_count() or 1,
+    'BATCH_SIZE': 256,
+    'SERIAL_THRESHOLD': 512,
+}
+
+# Seconds a session token stays in the process-local token -> user cache (see chat.utils).
+CHAT_TOKEN_CACHE_TTL = 60
+
+# Username typeahead: whether to answer from the in-memory index (chat.typeahead), how often
+# the index is reloaded, and how many requests a user may make per window (in seconds).
+CHAT_TYPEAHEAD = {
+    'USE_INDEX': True,
+    'REFRESH_INTERVAL': 300,
+    'MAX_RESULTS': 10,
+    'RATE_LIMIT': 20,
+    'RATE_WINDOW': 1,
+}
+
+# Dedicated pool for encryption on the WebSocket path (see crypto.executor). KIND is 'thread'
+# or 'process'; once MAX_PENDING jobs are queued, new messages are rejected with an error frame.
+CRYPTO_EXECUTOR = {
+    'KIND': 'thread',
+    'WORKERS': 4,
+    'MAX_PENDING': 1000,
+}
+
+# Write-behind persistence of chat messages (see chat.persistence): pending messages are
+# saved after FLUSH_INTERVAL seconds or as soon as BATCH_SIZE of them are queued.
+CHAT_WRITE_BEHIND = {
+    'FLUSH_INTERVAL': 0.05,
+    'BATCH_SIZE': 100,
+}
+
+# WebSocket history preload (chat.consumers): a client connecting with ?history=N gets the room
+# key and its latest min(N, MAX_MESSAGES) messages as the first frame.
+CHAT_WS_HISTORY = {
+    'MAX_MESSAGES': 50,
+}
+
+# In-process metrics (chat.metrics), exposed on /metrics in the Prometheus text format.
+CHAT_METRICS = {
+    'ENABLED': True,
+}
+
+# Usernames of the chat users allowed on the diagnostic pages (/query_reports/, /profiling/).
+CHAT_ADMINS = []
+
+# Per-request SQL reports (chat.querylog): a statement run REPEAT_THRESHOLD times in one
+# request or WebSocket frame is flagged as N+1. The last BUFFER_SIZE reports are shown on
+# /query_reports/ (CHAT_ADMINS only), and written to the 'chat.queries' logger when LOG is set.
+CHAT_QUERY_PROFILER = {
+    'ENABLED': False,
+    'REPEAT_THRESHOLD': 3,
+    'BUFFER_SIZE': 100,
+    'LOG': True,
+}
+
+# Sampling profiler (chat.profiling): SAMPLE_RATE is the fraction of HTTP requests and
+# WebSocket receive calls whose stacks are sampled every INTERVAL seconds and written as
+# collapsed stacks to OUTPUT_DIR. A request or WebSocket handshake with HEADER set to TOKEN
+# is always profiled (no TOKEN disables the header); CHAT_ADMINS can also start captures on /profiling/.
+CHAT_PROFILER = {
+    'ENABLED': False,
+    'SAMPLE_RATE': 0.0,
+    'INTERVAL': 0.001,
+    'OUTPUT_DIR': BASE_DIR / 'profiles',
+    'HEADER': 'X-Chat-Profile',
+    'TOKEN': None,
+}
+
 LOGIN_REDIRECT_URL = "chat-page"
 LOGOUT_REDIRECT_URL = "login-user"
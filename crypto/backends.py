@@ -0,0 +1,174 @@
+import rsa
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives.asymmetric import rsa as rsa_openssl
+
+# Size in bits of newly generated RSA keys.
+KEY_SIZE = 2048
+
+
+class DecryptionError(Exception):
+    """
+    Raised by a backend when a ciphertext cannot be decrypted with the given key.
+    """
+
+
+class RsaBackend:
+    """
+    Pure-Python backend built on the `rsa` package.
+
+    Keys are `rsa.PublicKey` / `rsa.PrivateKey` instances and are stored as PKCS#1 PEM.
+    Encryption uses PKCS#1 v1.5 padding.
+    """
+    name = 'rsa'
+
+    def new_keys(self):
+        """
+        Generates a new RSA key pair.
+
+        Returns:
+            tuple: The (public key, private key) pair.
+        """
+        return rsa.newkeys(KEY_SIZE)
+
+    def save_keys(self, pub_key, priv_key):
+        """
+        Serializes a key pair to PKCS#1 PEM.
+
+        Returns:
+            tuple: The (public PEM, private PEM) pair as bytes.
+        """
+        return pub_key.save_pkcs1('PEM'), priv_key.save_pkcs1('PEM')
+
+    def load_keys(self, pub_pem, priv_pem):
+        """
+        Loads a key pair from PKCS#1 PEM.
+
+        Returns:
+            tuple: The (public key, private key) pair.
+        """
+        return rsa.PublicKey.load_pkcs1(pub_pem), rsa.PrivateKey.load_pkcs1(priv_pem)
+
+    def encrypt(self, data, pub_key):
+        """
+        Encrypts bytes with the public key.
+
+        Returns:
+            bytes: The ciphertext.
+        """
+        return rsa.encrypt(data, pub_key)
+
+    def decrypt(self, ciphertext, priv_key):
+        """
+        Decrypts bytes with the private key.
+
+        Returns:
+            bytes: The plaintext.
+
+        Raises:
+            DecryptionError: If the ciphertext was not produced for this key.
+        """
+        try:
+            return rsa.decrypt(ciphertext, priv_key)
+        except rsa.pkcs1.DecryptionError as e:
+            raise DecryptionError(str(e)) from e
+
+
+class OpenSSLBackend:
+    """
+    Native backend built on the OpenSSL bindings of the `cryptography` package.
+
+    It reads and writes the same PKCS#1 PEM files and uses the same PKCS#1 v1.5 padding
+    as `RsaBackend`, so keys and ciphertexts are interchangeable between the two.
+    """
+    name = 'openssl'
+
+    def new_keys(self):
+        """
+        Generates a new RSA key pair.
+
+        Returns:
+            tuple: The (public key, private key) pair.
+        """
+        priv_key = rsa_openssl.generate_private_key(public_exponent=65537, key_size=KEY_SIZE)
+        return priv_key.public_key(), priv_key
+
+    def save_keys(self, pub_key, priv_key):
+        """
+        Serializes a key pair to PKCS#1 PEM.
+
+        Returns:
+            tuple: The (public PEM, private PEM) pair as bytes.
+        """
+        pub_pem = pub_key.public_bytes(
+            serialization.Encoding.PEM,
+            serialization.PublicFormat.PKCS1
+        )
+        priv_pem = priv_key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.TraditionalOpenSSL,
+            serialization.NoEncryption()
+        )
+        return pub_pem, priv_pem
+
+    def load_keys(self, pub_pem, priv_pem):
+        """
+        Loads a key pair from PKCS#1 PEM.
+
+        Returns:
+            tuple: The (public key, private key) pair.
+        """
+        return (
+            serialization.load_pem_public_key(pub_pem),
+            serialization.load_pem_private_key(priv_pem, password=None)
+        )
+
+    def encrypt(self, data, pub_key):
+        """
+        Encrypts bytes with the public key.
+
+        Returns:
+            bytes: The ciphertext.
+        """
+        return pub_key.encrypt(data, padding.PKCS1v15())
+
+    def decrypt(self, ciphertext, priv_key):
+        """
+        Decrypts bytes with the private key.
+
+        Returns:
+            bytes: The plaintext.
+
+        Raises:
+            DecryptionError: If the ciphertext was not produced for this key.
+        """
+        try:
+            return priv_key.decrypt(ciphertext, padding.PKCS1v15())
+        except ValueError as e:
+            raise DecryptionError(str(e)) from e
+
+
+# Registry of available backends, keyed by the name used in the CRYPTO_BACKEND setting.
+BACKENDS = {
+    RsaBackend.name: RsaBackend,
+    OpenSSLBackend.name: OpenSSLBackend,
+}
+
+
+def get_backend(name):
+    """
+    Instantiates a registered backend by name.
+
+    Args:
+        name (str): The backend name, e.g. 'rsa' or 'openssl'.
+
+    Returns:
+        The backend instance.
+
+    Raises:
+        ValueError: If no backend is registered under that name.
+    """
+    try:
+        return BACKENDS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown crypto backend '{name}'. Available: {', '.join(sorted(BACKENDS))}")
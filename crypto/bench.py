@@ -0,0 +1,274 @@
+"""
+Microbenchmarks for `crypto.crypt`.
+
+Run from the project root, e.g.::
+
+    python -m crypto.bench --backend openssl --processes 1 4 --output crypto-bench.json
+
+Every operation is timed call by call and reported as ops/s plus a histogram of µs/op in
+power-of-two buckets. Message-sized operations run for each size from 1 byte up to
+`--max-size` (legacy RSA messages stop at `RSA_MAX_MESSAGE`). With several process counts
+each operation also runs concurrently in that many spawned processes, and ops/s is the
+aggregate over all of them.
+"""
+import argparse
+import atexit
+import base64
+import json
+import math
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+import crypto.crypt
+from crypto.backends import BACKENDS
+
+# Largest message legacy RSA encryption accepts: a 2048-bit key minus PKCS#1 v1.5 padding.
+RSA_MAX_MESSAGE = 245
+
+# Operations timed once per message size, and operations that do not depend on it.
+SIZED_OPERATIONS = [
+    'encrypt_rsa', 'decrypt_rsa', 'encrypt', 'decrypt', 'decrypt_cached',
+    'b64encode', 'b64decode', 'decrypt_many',
+]
+KEY_OPERATIONS = ['generate_keys', 'load_keys', 'generate_data_key', 'unwrap_data_key', 'unwrap_data_key_cached']
+
+# Key generation takes seconds with the pure-Python backend, so it runs fewer times.
+SLOW_OPERATIONS = {'generate_keys': 3}
+
+
+def message_sizes(max_size):
+    """
+    Returns the message sizes to benchmark: powers of four from 1 byte, the RSA limit and `max_size`.
+    """
+    sizes = {RSA_MAX_MESSAGE, max_size}
+    size = 1
+    while size < max_size:
+        sizes.add(size)
+        size *= 4
+    return sorted(size for size in sizes if size <= max_size)
+
+
+def build_operation(name, size, batch):
+    """
+    Prepares the inputs of one operation and returns a function running it once.
+
+    Returns:
+        tuple: The zero-argument function and the number of messages it handles per call,
+        or None if the operation does not apply to the size.
+    """
+    message = 'x' * size
+    data_key = crypto.crypt.generate_data_key()
+
+    if name == 'generate_keys':
+        keys_dir = tempfile.mkdtemp()
+        atexit.register(shutil.rmtree, keys_dir, True)
+        return lambda: crypto.crypt.generate_keys(keys_dir), 1
+    if name == 'load_keys':
+        return crypto.crypt.load_keys, 1
+    if name == 'generate_data_key':
+        return crypto.crypt.generate_data_key, 1
+    if name == 'unwrap_data_key':
+        def unwrap():
+            crypto.crypt.unwrap_data_key.cache_clear()
+            crypto.crypt.unwrap_data_key(data_key)
+        return unwrap, 1
+    if name == 'unwrap_data_key_cached':
+        return lambda: crypto.crypt.unwrap_data_key(data_key), 1
+
+    if name in ('encrypt_rsa', 'decrypt_rsa') and size > RSA_MAX_MESSAGE:
+        return None
+    if name == 'encrypt_rsa':
+        return lambda: crypto.crypt.encrypt(message), 1
+    if name == 'decrypt_rsa':
+        ciphertext = crypto.crypt.encrypt(message)
+        return lambda: crypto.crypt._decrypt(ciphertext, None), 1
+
+    ciphertext = crypto.crypt.encrypt(message, data_key)
+    if name == 'encrypt':
+        return lambda: crypto.crypt.encrypt(message, data_key), 1
+    if name == 'decrypt':
+        return lambda: crypto.crypt._decrypt(ciphertext, data_key), 1
+    if name == 'decrypt_cached':
+        crypto.crypt.decrypt(ciphertext, data_key)
+        return lambda: crypto.crypt.decrypt(ciphertext, data_key), 1
+
+    raw = base64.b64decode(ciphertext[len(crypto.crypt.ENVELOPE_HEADER):])
+    if name == 'b64encode':
+        return lambda: base64.b64encode(raw), 1
+    if name == 'b64decode':
+        encoded = base64.b64encode(raw)
+        return lambda: base64.b64decode(encoded), 1
+
+    if name == 'decrypt_many':
+        # Distinct ciphertexts, so the plaintext cache only helps the repeated runs.
+        ciphertexts = [crypto.crypt.encrypt(message, data_key) for _ in range(batch)]
+
+        def decrypt_batch():
+            crypto.crypt.plaintext_cache.clear()
+            for _ in crypto.crypt.decrypt_many(ciphertexts, data_key):
+                pass
+        return decrypt_batch, batch
+
+    raise ValueError(f'Unknown operation: {name}')
+
+
+def time_operation(backend_name, name, size, iterations, batch):
+    """
+    Runs one operation `iterations` times under `backend_name` and returns the per-message timings.
+
+    Also the entry point of the worker processes, so it configures the backend itself.
+
+    Returns:
+        list: Seconds per message of each call, or None if the operation does not apply.
+    """
+    crypto.crypt.configure(backend_name)
+    built = build_operation(name, size, batch)
+    if built is None:
+        return None
+
+    operation, messages = built
+    operation()
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        operation()
+        timings.append((time.perf_counter() - started) / messages)
+    return timings
+
+
+def run_case(backend_name, name, size, iterations, batch, processes):
+    """
+    Times an operation in `processes` processes at once (in this process when 1).
+
+    Returns:
+        dict: Aggregate ops/s and the µs/op statistics, or None if the operation does not apply.
+    """
+    if processes == 1:
+        results = [time_operation(backend_name, name, size, iterations, batch)]
+    else:
+        with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('spawn')) as pool:
+            futures = [
+                pool.submit(time_operation, backend_name, name, size, iterations, batch)
+                for _ in range(processes)
+            ]
+            results = [future.result() for future in futures]
+
+    if results[0] is None:
+        return None
+
+    # The processes run side by side, so their rates add up. Only the timed calls count,
+    # which leaves worker start-up out.
+    return {
+        'ops_per_second': sum(len(result) / sum(result) for result in results),
+        'us_per_op': summarize_us([timing for result in results for timing in result]),
+        'histogram_us': histogram_us([timing for result in results for timing in result]),
+    }
+
+
+def summarize_us(timings):
+    """
+    Returns the mean, p50, p95, p99 and max of `timings` (seconds) in microseconds.
+    """
+    ordered = sorted(timings)
+
+    def percentile(p):
+        return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)] * 1e6
+
+    return {
+        'count': len(ordered),
+        'mean': sum(ordered) / len(ordered) * 1e6,
+        'p50': percentile(50),
+        'p95': percentile(95),
+        'p99': percentile(99),
+        'max': ordered[-1] * 1e6,
+    }
+
+
+def histogram_us(timings):
+    """
+    Counts `timings` (seconds) in power-of-two microsecond buckets, keyed by their upper bound.
+    """
+    counts = {}
+    for timing in timings:
+        bound = 2 ** max(0, math.ceil(math.log2(max(timing * 1e6, 1))))
+        counts[bound] = counts.get(bound, 0) + 1
+    return {f'<={bound}': counts[bound] for bound in sorted(counts)}
+
+
+def run(backends, processes, max_size, iterations, batch, operations=None):
+    """
+    Runs every selected operation for every backend, size and process count.
+
+    Returns:
+        dict: The report, with one result per operation, keyed by backend, process count,
+        operation and message size.
+    """
+    results = {}
+    for backend_name in backends:
+        for count in processes:
+            cases = {}
+            for name in KEY_OPERATIONS + SIZED_OPERATIONS:
+                if operations and name not in operations:
+                    continue
+                sizes = message_sizes(max_size) if name in SIZED_OPERATIONS else [0]
+                runs = SLOW_OPERATIONS.get(name, iterations)
+                for size in sizes:
+                    result = run_case(backend_name, name, size, runs, batch, count)
+                    if result is not None:
+                        cases.setdefault(name, {})[str(size) if name in SIZED_OPERATIONS else 'n/a'] = result
+            results.setdefault(backend_name, {})[f'{count}_processes'] = cases
+
+    return {
+        'benchmark': 'crypto',
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'environment': {
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'config': {
+            'backends': backends,
+            'processes': processes,
+            'max_size': max_size,
+            'iterations': iterations,
+            'batch': batch,
+            'pool_workers': crypto.crypt.pool_workers,
+        },
+        'results': results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the operations of crypto.crypt.')
+    parser.add_argument('--backend', nargs='+', choices=list(BACKENDS), default=list(BACKENDS),
+                        help='Backends to benchmark.')
+    parser.add_argument('--processes', nargs='+', type=int, default=[1, os.cpu_count() or 1],
+                        help='Process counts to run every operation with.')
+    parser.add_argument('--operation', nargs='+', choices=KEY_OPERATIONS + SIZED_OPERATIONS,
+                        help='Operations to run; all by default.')
+    parser.add_argument('--max-size', type=int, default=64 * 1024, help='Largest message size in bytes.')
+    parser.add_argument('--iterations', type=int, default=200, help='Timed calls per operation and size.')
+    parser.add_argument('--batch', type=int, default=1000, help='Messages per decrypt_many call.')
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout.')
+    args = parser.parse_args(argv)
+
+    report = run(
+        args.backend, sorted(set(args.processes)), args.max_size, args.iterations, args.batch, args.operation
+    )
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
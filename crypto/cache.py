@@ -0,0 +1,126 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class PlaintextCache:
+    """
+    A bounded, thread-safe LRU cache of decrypted message plaintext.
+
+    Entries are keyed by a SHA-256 digest of the ciphertext (and the data key it was sealed
+    with), so callers never need to know message ids. The cache is bounded both by entry
+    count and by the total size of the cached plaintext; the least recently used entries
+    are evicted first. Plaintext is held in a `bytearray` so it can be overwritten with
+    zeros when evicted if `zero_on_evict` is set.
+
+    Attributes:
+        max_entries (int): Maximum number of cached plaintexts. 0 disables the cache.
+        max_bytes (int): Maximum total size in bytes of the cached plaintexts.
+        zero_on_evict (bool): Whether evicted plaintext buffers are overwritten with zeros.
+        hits (int): Number of lookups answered from the cache.
+        misses (int): Number of lookups that were not in the cache.
+        evictions (int): Number of entries dropped to stay within the limits.
+    """
+
+    def __init__(self, max_entries=10000, max_bytes=8 * 1024 * 1024, zero_on_evict=False):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.zero_on_evict = zero_on_evict
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(ciphertext, data_key=None):
+        """
+        Builds the cache key for a ciphertext.
+
+        Args:
+            ciphertext (str): The Base64-encoded encrypted message.
+            data_key (str, optional): The wrapped data key the message was sealed with.
+
+        Returns:
+            bytes: The SHA-256 digest identifying the entry.
+        """
+        digest = hashlib.sha256(ciphertext.encode())
+        if data_key:
+            digest.update(b'|' + data_key.encode())
+        return digest.digest()
+
+    def get(self, key):
+        """
+        Looks up a plaintext and marks it as most recently used.
+
+        Args:
+            key (bytes): A key from `make_key`.
+
+        Returns:
+            str: The cached plaintext, or None if it is not cached.
+        """
+        with self._lock:
+            buf = self._entries.get(key)
+            if buf is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return buf.decode('utf-8')
+
+    def put(self, key, plaintext):
+        """
+        Stores a plaintext, evicting least recently used entries as needed.
+
+        Plaintexts larger than `max_bytes` are not cached.
+
+        Args:
+            key (bytes): A key from `make_key`.
+            plaintext (str): The decrypted message.
+        """
+        buf = bytearray(plaintext.encode('utf-8'))
+        if not self.max_entries or len(buf) > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._discard(old)
+            self._entries[key] = buf
+            self._size += len(buf)
+
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._discard(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        """
+        Drops every entry. Counters are left untouched.
+        """
+        with self._lock:
+            for buf in self._entries.values():
+                self._discard(buf)
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Returns the cache counters and current usage.
+
+        Returns:
+            dict: The hits, misses, evictions, entries and bytes of the cache.
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._size,
+            }
+
+    def _discard(self, buf):
+        self._size -= len(buf)
+        if self.zero_on_evict:
+            buf[:] = bytes(len(buf))
@@ -1,35 +1,70 @@
+import atexit
 import base64
+import multiprocessing
 import os
-import rsa
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import chain, islice
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from crypto.backends import DecryptionError, get_backend
+from crypto.cache import PlaintextCache
 
 # Get the current working directory of the script
 cwd = os.path.dirname(os.path.abspath(__file__))
 
+# Backend used until `configure` selects another one (see CRYPTO_BACKEND in settings).
+DEFAULT_BACKEND = 'rsa'
+
+backend = get_backend(DEFAULT_BACKEND)
+
+# Process-wide cache of decrypted plaintext, shared by every caller of `decrypt`.
+plaintext_cache = PlaintextCache()
+
+# Settings of the process pool used by `decrypt_many` (see `configure_pool`).
+pool_workers = os.cpu_count() or 1
+pool_batch_size = 256
+pool_serial_threshold = 512
+
+_pool = None
+# Guards the creation and shutdown of `_pool`, which request threads may race on.
+_pool_lock = threading.Lock()
 
-def generate_keys():
+# Optional callable receiving `(operation, seconds)` after every encrypt and every decrypt
+# that misses the plaintext cache, e.g. to feed a metrics histogram. None skips the timing.
+observer = None
+
+
+def generate_keys(keys_dir=None):
     """
     Generates a pair of RSA keys (public and private) and saves them to files.
 
-    The function generates a new 2048-bit RSA key pair using the `rsa` library.
+    The function generates a new 2048-bit RSA key pair using the active backend.
     It then saves the public key to 'pubkey.pem' and the private key to 'privkey.pem'
     in a directory named 'keys' within the current working directory.
 
-    Raises:
-        FileNotFoundError: If the 'keys' directory does not exist.
+    Args:
+        keys_dir (str, optional): Directory to write the keys to instead of 'keys'.
     """
-    (pubKey, privKey) = rsa.newkeys(2048)
+    pub_key, priv_key = backend.new_keys()
+    pub_pem, priv_pem = backend.save_keys(pub_key, priv_key)
 
-    keys_dir = os.path.join(cwd, 'keys')
+    keys_dir = keys_dir or os.path.join(cwd, 'keys')
     os.makedirs(keys_dir, exist_ok=True)
 
     with open(f'{keys_dir}/pubkey.pem', 'wb') as f:
-        f.write(pubKey.save_pkcs1('PEM'))
+        f.write(pub_pem)
 
     with open(f'{keys_dir}/privkey.pem', 'wb') as f:
-        f.write(privKey.save_pkcs1('PEM'))
+        f.write(priv_pem)
 
 
-def load_keys():
+def load_keys(keys_dir=None):
     """
     Loads the RSA public and private keys from the 'keys' directory.
 
@@ -37,39 +72,145 @@ def load_keys():
     'privkey.pem' files in the 'keys' directory within the current working directory.
     It returns both keys for use in encryption and decryption operations.
 
+    Args:
+        keys_dir (str, optional): Directory to read the keys from instead of 'keys'.
+
     Returns:
-        tuple: A tuple containing the public key and private key as
-               (rsa.PublicKey, rsa.PrivateKey).
+        tuple: A tuple containing the public key and private key, as objects of
+               the active backend.
 
     Raises:
         FileNotFoundError: If the key files do not exist.
-        rsa.pkcs1.DecryptionError: If the keys are not in the correct format.
+        ValueError: If the keys are not in the correct format.
     """
-    # Load the public key from 'pubkey.pem'
-    with open(f'{cwd}/keys/pubkey.pem', 'rb') as f:
-        pubKey = rsa.PublicKey.load_pkcs1(f.read())
+    keys_dir = keys_dir or os.path.join(cwd, 'keys')
 
-    with open(f'{cwd}/keys/privkey.pem', 'rb') as f:
-        privKey = rsa.PrivateKey.load_pkcs1(f.read())
+    with open(f'{keys_dir}/pubkey.pem', 'rb') as f:
+        pub_pem = f.read()
 
-    return pubKey, privKey
+    with open(f'{keys_dir}/privkey.pem', 'rb') as f:
+        priv_pem = f.read()
+
+    return backend.load_keys(pub_pem, priv_pem)
 
 
 pubKey, privKey = load_keys()
 
 
+def configure(backend_name):
+    """
+    Switches the active crypto backend and reloads the keys with it.
+
+    Args:
+        backend_name (str): A name registered in `crypto.backends.BACKENDS`.
+
+    Raises:
+        ValueError: If the backend name is unknown.
+    """
+    global backend, pubKey, privKey
+
+    if backend_name == backend.name:
+        return
+
+    backend = get_backend(backend_name)
+    pubKey, privKey = load_keys()
+    unwrap_data_key.cache_clear()
+    shutdown_pool()
+
+
+def configure_pool(workers=None, batch_size=None, serial_threshold=None):
+    """
+    Reconfigures the process pool used by `decrypt_many`.
+
+    A running pool is shut down and restarted lazily with the new size. Arguments left
+    as None keep their current value.
+
+    Args:
+        workers (int, optional): Number of worker processes. 1 or less disables the pool.
+        batch_size (int, optional): Number of messages sent to a worker at once.
+        serial_threshold (int, optional): Inputs shorter than this are decrypted serially.
+    """
+    global pool_workers, pool_batch_size, pool_serial_threshold
+
+    if workers is not None:
+        pool_workers = workers
+    if batch_size is not None:
+        pool_batch_size = batch_size
+    if serial_threshold is not None:
+        pool_serial_threshold = serial_threshold
+    shutdown_pool()
+
+
+def shutdown_pool():
+    """
+    Stops the `decrypt_many` worker processes, if any are running.
+    """
+    global _pool
+
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(cancel_futures=True)
+
+
+atexit.register(shutdown_pool)
+
+
+def _get_pool():
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=pool_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=configure,
+                initargs=(backend.name,)
+            )
+        return _pool
+
+
+def configure_cache(max_entries=None, max_bytes=None, zero_on_evict=None):
+    """
+    Reconfigures the plaintext cache used by `decrypt`.
+
+    The cache is emptied so the new limits apply to every entry. Arguments left as None
+    keep their current value.
+
+    Args:
+        max_entries (int, optional): Maximum number of cached plaintexts. 0 disables the cache.
+        max_bytes (int, optional): Maximum total size in bytes of the cached plaintexts.
+        zero_on_evict (bool, optional): Whether evicted plaintext is overwritten with zeros.
+    """
+    if max_entries is not None:
+        plaintext_cache.max_entries = max_entries
+    if max_bytes is not None:
+        plaintext_cache.max_bytes = max_bytes
+    if zero_on_evict is not None:
+        plaintext_cache.zero_on_evict = zero_on_evict
+    plaintext_cache.clear()
+
+
+# Version header prepended to envelope-encrypted messages. Messages stored before
+# the envelope scheme are bare Base64 RSA ciphertexts and carry no header.
+ENVELOPE_HEADER = 'v2:'
+
+# Size in bytes of the random AES-GCM nonce stored in front of each ciphertext.
+NONCE_SIZE = 12
+
+
 def encrypt_rsa(msg, key):
     """
     Encrypts a message using the RSA encryption algorithm.
 
     Args:
         msg (str): The plaintext message to be encrypted.
-        key (rsa.PublicKey): The RSA public key used for encryption.
+        key: The RSA public key used for encryption.
 
     Returns:
         bytes: The encrypted message in bytes.
     """
-    return rsa.encrypt(msg.encode('utf-8'), key)
+    return backend.encrypt(msg.encode('utf-8'), key)
 
 
 def decrypt_rsa(ciphertext, key):
@@ -78,48 +219,201 @@ def decrypt_rsa(ciphertext, key):
 
     Args:
         ciphertext (bytes): The encrypted message in bytes.
-        key (rsa.PrivateKey): The RSA private key used for decryption.
+        key: The RSA private key used for decryption.
 
     Returns:
         str: The decrypted plaintext message if decryption is successful.
         bool: False if decryption fails.
     """
     try:
-        return rsa.decrypt(ciphertext, key).decode('utf-8')
+        return backend.decrypt(ciphertext, key).decode('utf-8')
     except:
         return False
 
 
-def encrypt(msg):
+def generate_data_key():
+    """
+    Generates a new symmetric data key and wraps it with the RSA public key.
+
+    The data key is a random 256-bit AES key. Only its RSA-wrapped form is
+    returned, so it can be stored next to the data it protects (e.g. on a chat room).
+
+    Returns:
+        str: The Base64-encoded, RSA-wrapped data key.
+    """
+    key = AESGCM.generate_key(bit_length=256)
+    return base64.b64encode(backend.encrypt(key, pubKey)).decode()
+
+
+@lru_cache(maxsize=1024)
+def unwrap_data_key(wrapped_key):
+    """
+    Unwraps a data key produced by `generate_data_key`.
+
+    Results are memoized, so the RSA private key operation runs once per data key
+    per process instead of once per message.
+
+    Args:
+        wrapped_key (str): The Base64-encoded, RSA-wrapped data key.
+
+    Returns:
+        bytes: The raw AES data key.
+
+    Raises:
+        DecryptionError: If the key was not wrapped with our RSA key.
+    """
+    return backend.decrypt(base64.b64decode(wrapped_key), privKey)
+
+
+def encrypt(msg, data_key=None):
     """
-    Encrypts a message using RSA and encodes it in Base64.
+    Encrypts a message and encodes it in Base64.
+
+    When a wrapped data key is given, the message is sealed with AES-GCM under that
+    key and prefixed with the envelope version header. Without a data key the message
+    is encrypted directly with RSA, which limits it to 245 bytes.
 
     Args:
         msg (str): The plaintext message to be encrypted.
+        data_key (str, optional): The RSA-wrapped data key from `generate_data_key`.
 
     Returns:
         str: The Base64-encoded encrypted message.
     """
-    ciphertext = encrypt_rsa(msg, pubKey)
-    encoded = base64.b64encode(ciphertext)
-    return encoded.decode()
+    return _timed('encrypt', _encrypt, msg, data_key)
+
+
+def _encrypt(msg, data_key):
+    if data_key is None:
+        ciphertext = encrypt_rsa(msg, pubKey)
+        encoded = base64.b64encode(ciphertext)
+        return encoded.decode()
+
+    nonce = os.urandom(NONCE_SIZE)
+    sealed = AESGCM(unwrap_data_key(data_key)).encrypt(nonce, msg.encode('utf-8'), ENVELOPE_HEADER.encode())
+    return ENVELOPE_HEADER + base64.b64encode(nonce + sealed).decode()
 
 
-def decrypt(message):
+def decrypt(message, data_key=None):
     """
-    Decrypts a Base64-encoded RSA-encrypted message.
+    Decrypts a message produced by `encrypt`.
+
+    Envelope messages (with the version header) are opened with the given data key.
+    Messages without the header are treated as legacy RSA ciphertexts. Successfully
+    decrypted plaintext is kept in `plaintext_cache`, so repeated reads of the same
+    history skip the cipher entirely.
 
     Args:
         message (str): The Base64-encoded encrypted message.
+        data_key (str, optional): The RSA-wrapped data key the message was sealed with.
 
     Returns:
         str: The decrypted plaintext message if successful, otherwise an error message.
     """
+    key = plaintext_cache.make_key(message, data_key)
+    plaintext = plaintext_cache.get(key)
+    if plaintext is not None:
+        return plaintext
+
+    plaintext = _timed('decrypt', _decrypt, message, data_key)
+    if plaintext is None:
+        return 'Could not decrypt the message.'
+
+    plaintext_cache.put(key, plaintext)
+    return plaintext
+
+
+def _timed(operation, func, *args):
+    if observer is None:
+        return func(*args)
+    started = time.perf_counter()
+    try:
+        return func(*args)
+    finally:
+        observer(operation, time.perf_counter() - started)
+
+
+def _decrypt(message, data_key):
+    if message.startswith(ENVELOPE_HEADER):
+        if not data_key:
+            return None
+        raw = base64.b64decode(message[len(ENVELOPE_HEADER):])
+        try:
+            plaintext = AESGCM(unwrap_data_key(data_key)).decrypt(
+                raw[:NONCE_SIZE], raw[NONCE_SIZE:], ENVELOPE_HEADER.encode()
+            )
+        except (InvalidTag, DecryptionError, ValueError):
+            return None
+        return plaintext.decode('utf-8')
+
     message = base64.b64decode(message)
     plaintext = decrypt_rsa(message, privKey)
     if plaintext:
         return plaintext
     else:
-        return 'Could not decrypt the message.'
+        return None
 
 
+def decrypt_many(messages, data_key=None):
+    """
+    Decrypts a sequence of messages, spreading the work over a process pool.
+
+    Items are either ciphertext strings, which are opened with `data_key`, or
+    `(ciphertext, data_key)` pairs for messages from different rooms. Plaintexts are
+    yielded in input order as soon as the batch containing them is done, so callers can
+    start consuming results before the whole input is decrypted. Inputs shorter than
+    `pool_serial_threshold` are decrypted in-process, and cached plaintexts never leave
+    the calling process.
+
+    Args:
+        messages (iterable): The Base64-encoded encrypted messages.
+        data_key (str, optional): The RSA-wrapped data key for items given as plain strings.
+
+    Yields:
+        str: The decrypted plaintext of each message, or an error message.
+    """
+    items = (item if isinstance(item, tuple) else (item, data_key) for item in messages)
+    head = list(islice(items, pool_serial_threshold))
+
+    if len(head) < pool_serial_threshold or pool_workers <= 1:
+        for message, key in chain(head, items):
+            yield decrypt(message, key)
+        return
+
+    pool = _get_pool()
+    pending = deque()
+    items = chain(head, items)
+    while True:
+        batch = list(islice(items, pool_batch_size))
+        if not batch:
+            break
+        pending.append(_submit_batch(pool, batch))
+        if len(pending) > pool_workers * 2:
+            yield from _collect_batch(*pending.popleft())
+
+    while pending:
+        yield from _collect_batch(*pending.popleft())
+
+
+def _submit_batch(pool, batch):
+    keys = [plaintext_cache.make_key(message, key) for message, key in batch]
+    results = [plaintext_cache.get(key) for key in keys]
+    misses = [pair for pair, result in zip(batch, results) if result is None]
+    future = pool.submit(_decrypt_batch, misses) if misses else None
+    return keys, results, future
+
+
+def _collect_batch(keys, results, future):
+    decrypted = iter(future.result() if future else ())
+    for key, result in zip(keys, results):
+        if result is None:
+            result = next(decrypted)
+            if result is None:
+                result = 'Could not decrypt the message.'
+            else:
+                plaintext_cache.put(key, result)
+        yield result
+
+
+def _decrypt_batch(batch):
+    return [_decrypt(message, key) for message, key in batch]
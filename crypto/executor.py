@@ -0,0 +1,154 @@
+import asyncio
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import crypto.crypt
+
+
+class ExecutorSaturated(Exception):
+    """
+    Raised by `CryptoExecutor.run` when `max_pending` jobs are already queued or running.
+    """
+
+
+def _timed_call(submitted_at, func, *args):
+    started_at = time.monotonic()
+    return started_at - submitted_at, func(*args)
+
+
+class CryptoExecutor:
+    """
+    A dedicated, bounded pool for CPU-heavy crypto work submitted from async code.
+
+    Keeping crypto off the default `sync_to_async` threads stops it from competing with
+    database I/O. At most `max_pending` jobs may be queued or running at once; further
+    submissions fail fast with `ExecutorSaturated`, so callers can push back on clients
+    instead of letting latency grow without bound.
+
+    Attributes:
+        kind (str): 'thread' for a thread pool or 'process' for a process pool.
+        workers (int): Number of worker threads or processes.
+        max_pending (int): Maximum number of jobs queued or running at once.
+        observer (callable): Called with the seconds each job waited in the queue, if set.
+    """
+
+    def __init__(self, kind='thread', workers=4, max_pending=1000):
+        self.kind = kind
+        self.workers = workers
+        self.max_pending = max_pending
+        self._pool = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._submitted = 0
+        self._rejected = 0
+        self._completed = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self.observer = None
+
+    def configure(self, kind=None, workers=None, max_pending=None):
+        """
+        Changes the pool settings; a running pool is shut down and restarted lazily.
+
+        Arguments left as None keep their current value.
+        """
+        if kind is not None:
+            self.kind = kind
+        if workers is not None:
+            self.workers = workers
+        if max_pending is not None:
+            self.max_pending = max_pending
+        self.shutdown()
+
+    async def run(self, func, *args):
+        """
+        Runs `func(*args)` on the pool and returns its result.
+
+        Args:
+            func (callable): The function to run; must be picklable for a process pool.
+            *args: Its arguments.
+
+        Returns:
+            The return value of `func`.
+
+        Raises:
+            ExecutorSaturated: If `max_pending` jobs are already queued or running; nothing
+            was scheduled.
+            RuntimeError: If the pool refuses the job, e.g. while it is shut down.
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._rejected += 1
+                raise ExecutorSaturated(f'{self._pending} crypto jobs pending')
+            self._pending += 1
+            self._submitted += 1
+
+        try:
+            future = self._get_pool().submit(_timed_call, time.monotonic(), func, *args)
+        except Exception:
+            # Nothing was scheduled (e.g. the pool is shutting down), so the slot is released here.
+            with self._lock:
+                self._pending -= 1
+                self._submitted -= 1
+            raise
+        future.add_done_callback(self._job_done)
+        _, result = await asyncio.wrap_future(future)
+        return result
+
+    def stats(self):
+        """
+        Returns the executor's counters.
+
+        Returns:
+            dict: Jobs currently pending (queue depth including running jobs), submitted,
+            rejected and completed, and the mean and maximum time in seconds jobs waited
+            in the queue before starting.
+        """
+        with self._lock:
+            return {
+                'pending': self._pending,
+                'submitted': self._submitted,
+                'rejected': self._rejected,
+                'completed': self._completed,
+                'mean_wait': self._total_wait / self._completed if self._completed else 0.0,
+                'max_wait': self._max_wait,
+            }
+
+    def shutdown(self):
+        """
+        Stops the pool's workers, if any are running.
+        """
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            if self.kind == 'process':
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=crypto.crypt.configure,
+                    initargs=(crypto.crypt.backend.name,)
+                )
+            else:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='crypto')
+        return self._pool
+
+    def _job_done(self, future):
+        wait = 0.0
+        if not future.cancelled() and future.exception() is None:
+            wait, _ = future.result()
+        with self._lock:
+            self._pending -= 1
+            self._completed += 1
+            self._total_wait += wait
+            self._max_wait = max(self._max_wait, wait)
+        if self.observer is not None and not future.cancelled() and future.exception() is None:
+            self.observer(wait)
+
+
+crypto_executor = CryptoExecutor()
+